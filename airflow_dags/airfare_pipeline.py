@@ -50,7 +50,9 @@ with DAG(
         ETL(data_dir="aaa")
 
     def update_and_clean_data():
+        from src.etl.schema_migration import migrate_schema
         from src.etl.update_data import delete_old_tickets_and_flights
+        migrate_schema()
         delete_old_tickets_and_flights()
 
     def preprocess_to_train_model():
@@ -0,0 +1,163 @@
+"""
+Benchmark of the price-model candidates of model selection (and optionally their tuned
+variants): fit time, single-row and batch predict latency, peak RSS, pickled size and
+test R²/RMSE, on the modeling dataset and on synthetic copies with the training rows
+scaled 10x / 100x (the test split is always the original held-out rows).
+
+Each (dataset, model) run happens in a fresh process, so peak RSS is per model.
+Build the dataset first, then run from the project root:
+    python -m src.modeling.preprocess_data_for_modeling
+    python -m benchmarks.bench_models --scales 10 100
+    python -m benchmarks.bench_models --models XGBoost LightGBM --tuned --tuning-budget 120
+"""
+import io
+import time
+import resource
+import argparse
+import multiprocessing
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.metrics import r2_score, root_mean_squared_error
+
+from src.modeling.feature_pipeline import DATETIME_FEATURES, NUMERIC_COLUMNS, normalize_column_name
+from src.modeling.training_dataset import MODELING_DATA_DIR, load_training_dataset
+from src.modeling.modeling_data import (
+    as_model_input,
+    get_candidate_models,
+    model_tuning,
+    split_into_train_val_test,
+    stack_rows,
+    take_rows,
+)
+
+SINGLE_ROW_CALLS = 200
+SYNTHETIC_NOISE = 0.01
+
+
+def upsample(X, y, columns, scale, rng):
+    """
+    `scale` x as many rows, resampled with replacement, with small Gaussian noise on the
+    continuous (scaled numeric / datetime) columns so trees do not just memorize duplicates.
+    CSR matrices are only resampled.
+    """
+    idx = rng.randint(0, X.shape[0], size=X.shape[0] * scale)
+    y = pd.Series(y.to_numpy()[idx], name=y.name)
+    if sp.issparse(X):
+        return X[idx], y
+    X = pd.DataFrame(X.to_numpy()[idx], columns=columns)
+    continuous = [c for c in [normalize_column_name(c) for c in NUMERIC_COLUMNS] + DATETIME_FEATURES if c in columns]
+    X[continuous] += rng.normal(0, SYNTHETIC_NOISE, size=(len(X), len(continuous)))
+    return X, y
+
+
+def make_dataset(data_dir, scale, seed=42):
+    """
+    Train / val / test splits of the modeling dataset. With `scale` > 1 the train and val
+    splits are upsampled `scale` x (each from its own rows); the test split is always the
+    original held-out rows, so no resampled copy of a test row is trained on.
+    """
+    X, y, columns = load_training_dataset(data_dir, mmap=True)
+    X_train, X_val, X_test, y_train, y_val, y_test = split_into_train_val_test(X, y)
+    if scale > 1:
+        rng = np.random.RandomState(seed)
+        X_train, y_train = upsample(X_train, y_train, columns, scale, rng)
+        X_val, y_val = upsample(X_val, y_val, columns, scale, rng)
+    return X_train, X_val, X_test, y_train, y_val, y_test
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (Linux reports KiB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(data_dir, scale, name, model):
+    """Fit one candidate on the train+val split and measure it on the test split (runs in a child process)."""
+    X_train, X_val, X_test, y_train, y_val, y_test = make_dataset(data_dir, scale)
+    X_fit = as_model_input(stack_rows([X_train, X_val]), name)
+    y_fit = stack_rows([y_train, y_val])
+    X_test = as_model_input(X_test, name)
+    rss_before = peak_rss_mb()
+
+    start = time.perf_counter()
+    model.fit(X_fit, y_fit)
+    fit_seconds = time.perf_counter() - start
+    fit_rss = peak_rss_mb() - rss_before
+
+    start = time.perf_counter()
+    y_pred = model.predict(X_test)
+    batch_seconds = time.perf_counter() - start
+
+    single_latencies = []
+    for i in range(min(SINGLE_ROW_CALLS, X_test.shape[0])):
+        row = take_rows(X_test, [i])
+        start = time.perf_counter()
+        model.predict(row)
+        single_latencies.append(time.perf_counter() - start)
+
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    return {
+        "rows": X_fit.shape[0] + X_test.shape[0],
+        "model": name,
+        "fit (s)": round(fit_seconds, 2),
+        "1-row p50 (ms)": round(np.median(single_latencies) * 1000, 2),
+        "1-row p95 (ms)": round(np.percentile(single_latencies, 95) * 1000, 2),
+        "batch (rows/s)": round(X_test.shape[0] / batch_seconds),
+        "peak RSS (MB)": round(peak_rss_mb()),
+        "fit RSS (+MB)": round(fit_rss),
+        "pickle (MB)": round(buffer.tell() / 1e6, 2),
+        "R2": round(r2_score(y_test, y_pred), 4),
+        "RMSE": round(root_mean_squared_error(y_test, y_pred), 4),
+    }
+
+
+def tune_candidates(data_dir, candidates, budget):
+    """Tuned variants of the candidates, tuned once on the modeling dataset."""
+    X_train, X_val, _, y_train, y_val, _ = make_dataset(data_dir, 1)
+    tuned = []
+    for name, model in candidates:
+        tuned_model = model_tuning(model, X_train, y_train, X_val, y_val, model_name=name, time_budget=budget)
+        if tuned_model is not model:
+            tuned.append((f"{name} (tuned)", name, tuned_model))
+    return tuned
+
+
+def main():
+    candidate_names = [name for name, _ in get_candidate_models()]
+    parser = argparse.ArgumentParser(description="Benchmark the price-model candidates")
+    parser.add_argument("--data-dir", default=MODELING_DATA_DIR, help="Binary dataset written by preprocess_for_modeling")
+    parser.add_argument("--scales", type=int, nargs="*", default=[10, 100], help="Synthetic dataset sizes (x modeling dataset)")
+    parser.add_argument("--models", nargs="+", default=candidate_names, choices=candidate_names)
+    parser.add_argument("--tuned", action="store_true", help="Also benchmark the tuned variant of each candidate")
+    parser.add_argument("--tuning-budget", type=float, default=120, help="Tuning time budget per candidate (s)")
+    parser.add_argument("--output", help="Also write the results to this CSV file")
+    args = parser.parse_args()
+
+    candidates = [(name, model) for name, model in get_candidate_models() if name in args.models]
+    runs = [(name, name, model) for name, model in candidates]
+    if args.tuned:
+        runs += tune_candidates(args.data_dir, candidates, args.tuning_budget)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for scale in [1] + [s for s in args.scales if s != 1]:
+        print(f"\n=== {'modeling dataset' if scale == 1 else f'synthetic {scale}x'} ===")
+        for label, name, model in runs:
+            # One process per run: peak RSS is per model and nothing is reused between runs
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                result = pool.apply(measure, (args.data_dir, scale, name, model))
+            result["model"] = label
+            results.append(result)
+            print(f"{label:25} fit {result['fit (s)']:8.2f}s | R2 {result['R2']:.4f}")
+
+    df = pd.DataFrame(results)
+    print()
+    print(df.to_string(index=False))
+    if args.output:
+        df.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark of the sentiment model runtimes on CPU: fp32 PyTorch vs dynamically
+quantized int8 vs ONNX Runtime. Reports load time, model size, throughput and the
+agreement of the Negative/Neutral/Positive labels with the fp32 labels.
+
+Export the optimized runtimes once, then run from the project root:
+    python -m src.modeling.sentiment_runtime --export int8
+    python -m src.modeling.sentiment_runtime --export onnx
+    python -m benchmarks.bench_sentiment --limit 500
+"""
+import io
+import os
+import time
+import argparse
+import pandas as pd
+import torch
+
+from src.etl.preprocessing_airline_review import preprocess_text_information
+from src.modeling.sentiment_enrich import SENTIMENT_BATCH_SIZE, predict_sentiment_batch
+from src.modeling.sentiment_runtime import (
+    SENTIMENT_RUNTIMES,
+    OnnxSentimentModel,
+    check_agreement,
+    load_sentiment_model,
+)
+
+REVIEW_FILE = "data/raw/review/vj_all_reviews_data.csv"
+
+
+def model_size_mb(model):
+    """Serialized size of the model weights (ONNX: size of the graph file)."""
+    if isinstance(model, OnnxSentimentModel):
+        return os.path.getsize(model.model_path) / 1e6
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1e6
+
+
+def load_texts(path, limit):
+    df = pd.read_csv(path).head(limit)
+    df = preprocess_text_information(df)
+    return ("Title: " + df['Title'] + ", Review: " + df['Full Review']).tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sentiment runtimes on CPU")
+    parser.add_argument("--file", default=REVIEW_FILE, help="Raw review CSV to score")
+    parser.add_argument("--limit", type=int, default=500, help="Number of reviews to score")
+    parser.add_argument("--batch-size", type=int, default=SENTIMENT_BATCH_SIZE, help="Reviews per forward pass")
+    parser.add_argument("--runtimes", nargs="+", default=list(SENTIMENT_RUNTIMES), choices=SENTIMENT_RUNTIMES)
+    args = parser.parse_args()
+
+    texts = load_texts(args.file, args.limit)
+    print(f"Scoring {len(texts)} reviews, batch size {args.batch_size}, {torch.get_num_threads()} torch threads")
+
+    # fp32 labels are the reference for the agreement check
+    runtimes = ["fp32"] + [r for r in args.runtimes if r != "fp32"]
+    results, reference_labels = [], None
+    for runtime in runtimes:
+        try:
+            start = time.perf_counter()
+            tokenizer, model, _ = load_sentiment_model(runtime)
+            load_seconds = time.perf_counter() - start
+        except (FileNotFoundError, ImportError) as e:
+            print(f"Skipping {runtime}: {e}")
+            continue
+
+        predict_sentiment_batch(texts[:args.batch_size], tokenizer, model, args.batch_size)  # warm-up
+        start = time.perf_counter()
+        labels = predict_sentiment_batch(texts, tokenizer, model, args.batch_size)
+        seconds = time.perf_counter() - start
+
+        if reference_labels is None:
+            reference_labels = labels
+        agreement, confusion = check_agreement(reference_labels, labels)
+        results.append({
+            "runtime": runtime,
+            "load (s)": round(load_seconds, 2),
+            "size (MB)": round(model_size_mb(model), 1),
+            "score (s)": round(seconds, 2),
+            "reviews/s": round(len(texts) / seconds, 1),
+            "agreement": round(agreement, 4),
+        })
+        if runtime != "fp32":
+            print(f"\nfp32 (rows) vs {runtime} (columns):\n{confusion}")
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
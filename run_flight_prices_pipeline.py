@@ -6,6 +6,7 @@ import logging
 
 from src.crawler.abay_form_oneway import choose_datetime, craw_pipeline
 from src.etl.preprocessing_flight_prices import ETL
+from src.etl.schema_migration import migrate_schema
 from src.etl.update_data import delete_old_tickets_and_flights
 from src.modeling.preprocess_data_for_modeling import preprocess_for_modeling
 from src.modeling.modeling_data import model_data
@@ -38,6 +39,10 @@ def main(months=1, start_date=None):
     logging.info("Running ETL pipeline...")
     ETL(data_dir=datetime.now().strftime("%d_%m_%Y"))
 
+    # === Schema migration (indexes / keys, idempotent) ===
+    logging.info("Applying schema migration...")
+    migrate_schema()
+
     # === Clean old data ===
     logging.info("Deleting old ticket & schedule data...")
     delete_old_tickets_and_flights()
@@ -4,19 +4,12 @@ import numpy as np
 from datetime import datetime
 import json
 import os
-from sqlalchemy import create_engine 
 from dotenv import load_dotenv
+from src.utils.db_utils import get_engine
 load_dotenv()
 
 def connect_to_db():
-    server = os.getenv("DB_SERVER")
-    database = os.getenv("DB_NAME")
-    username = os.getenv("DB_USER")
-    password = os.getenv("DB_PASSWORD")
-    driver = 17
-    conn_str = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+{driver}+for+SQL+Server"
-    engine = create_engine(conn_str)
-    return engine
+    return get_engine()
 
 def get_id_from_db(airline_selected): 
     db_engine = connect_to_db()
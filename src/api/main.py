@@ -1,7 +1,8 @@
 from fastapi import FastAPI
 from pydantic import BaseModel
+import numpy as np
 import pandas as pd
-from ..deployment.inference import predict_airfare_real
+from ..deployment.inference import predict_airfare_batch, predict_airfare_real
 
 app = FastAPI()
 
@@ -19,9 +20,9 @@ class FlightInput(BaseModel):
     Scrape_Time: str
     Departure_Location: str
 
-@app.post("/predict")
-def predict_price(data: FlightInput):
-    input_df = pd.DataFrame([{
+def to_input_row(data: FlightInput):
+    """Map the API field names to the columns of the feature pipeline."""
+    return {
         "Carry-on_Baggage": data.Carry_on_Baggage,
         "Checked_Baggage": data.Checked_Baggage,
         "Flight_Duration": data.Flight_Duration,
@@ -33,10 +34,23 @@ def predict_price(data: FlightInput):
         "Departure_Time": data.Departure_Time,
         "Scrape_Time": data.Scrape_Time,
         "Departure_Location_Code": data.Departure_Location,
-    }])
+    }
+
+@app.post("/predict")
+def predict_price(data: FlightInput):
+    input_df = pd.DataFrame([to_input_row(data)])
 
     return {"predicted_price": int(predict_airfare_real(input_df))}
 
+@app.post("/predict/batch")
+def predict_price_batch(data: list[FlightInput]):
+    """Predict many flights in one request: one frame, one lookup per code table, one predict call."""
+    if not data:
+        return {"predicted_prices": []}
+    input_df = pd.DataFrame([to_input_row(item) for item in data])
+
+    return {"predicted_prices": predict_airfare_batch(input_df).astype(np.int64).tolist()}
+
 # uvicorn src.api.main:app --reload
 
 # curl -X 'POST' \
@@ -54,4 +68,9 @@ def predict_price(data: FlightInput):
 #   "Departure_Time": "2025-06-22 09:00:00",
 #   "Scrape_Time": "2025-06-01 08:00:00",
 #   "Departure_Location": "Ho Chi Minh City"
-# }'
\ No newline at end of file
+# }'
+
+# curl -X 'POST' \
+#   'http://127.0.0.1:8000/predict/batch' \
+#   -H 'Content-Type: application/json' \
+#   -d '[{...same fields as /predict...}, {...}]'
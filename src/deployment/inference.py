@@ -1,10 +1,14 @@
 import joblib
 import pandas as pd
-from unidecode import unidecode
 import os
 import numpy as np
-from sqlalchemy import create_engine
+import threading
 from dotenv import load_dotenv
+from sqlalchemy import bindparam, text
+from src.utils.db_utils import get_engine
+from src.modeling.feature_pipeline import load_pipeline
+from src.modeling.model_registry import current_mtime, load_model_version
+from src.modeling.shard_models import load_shard_models, predict_with_shards
 
 # ========================== Setup Path Constants ==========================
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
@@ -13,86 +17,92 @@ os.makedirs(MODEL_DIR, exist_ok=True)
 
 # ========================== Load Environment Variables ==========================
 load_dotenv()
-username = os.getenv("DB_USER")
-password = os.getenv("DB_PASSWORD")
-server = os.getenv("DB_SERVER")
-database = os.getenv("DB_NAME")
 
 # ========================== SQL Utilities ==========================
-def get_engine():
-    """Create and return a SQLAlchemy engine for SQL Server."""
-    conn_str = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+17+for+SQL+Server"
-    return create_engine(conn_str)
-
-def get_code_from_sql(engine, column_return, table, column_match, value):
-    """Query a specific value (code) from the SQL table."""
-    query = f"SELECT {column_return} FROM {table} WHERE {column_match} = ?"
-    result = pd.read_sql(query, engine, params=[(value,)])
-    return result.iloc[0, 0] if not result.empty else None
+def get_codes_from_sql(engine, column_return, table, column_match, values):
+    """Map many values to their codes with one query; values without a code map to NaN."""
+    values = pd.Series(values)
+    distinct = values.dropna().unique().tolist()
+    if not distinct:
+        return pd.Series(np.nan, index=values.index, dtype=object)
+    query = text(f"SELECT {column_match}, {column_return} FROM {table} WHERE {column_match} IN :values")
+    codes = pd.read_sql(query.bindparams(bindparam("values", expanding=True)), engine, params={"values": distinct})
+    # Keep an object column even if nothing matched (the encoder rejects an all-NaN float column)
+    return values.map(codes.drop_duplicates(column_match).set_index(column_match)[column_return]).astype(object)
 
 engine = get_engine()
 
-# ========================== Load Trained Model & Encoders ==========================
-model = joblib.load(os.path.join(MODEL_DIR, "final_best_model.pkl"))
-scaler = joblib.load(os.path.join(MODEL_DIR, "scalers_per_column.pkl"))
-onehot_encoder = joblib.load(os.path.join(MODEL_DIR, "onehot_encoder.pkl"))
-label_binarizer = joblib.load(os.path.join(MODEL_DIR, "multilabel_binarizer_refund_policy.pkl"))
+# ========================== Load Trained Model & Feature Pipeline ==========================
+# Held while the deployed model is swapped or snapshotted, so a request never mixes
+# the model of one version with the pipeline of another; reload_lock serializes reloads
+model_lock = threading.Lock()
+reload_lock = threading.Lock()
+
+def load_model(version=None):
+    """
+    Load the current (or given) registry version, memory-mapped; falls back to the files in
+    models/ for models trained before the registry existed.
+    """
+    global model, pipeline, shard_models, model_version, loaded_mtime
+    mtime = current_mtime()
+    registered = load_model_version(version)
+    if registered is None:
+        loaded = (
+            joblib.load(os.path.join(MODEL_DIR, "final_best_model.pkl")),
+            load_pipeline(MODEL_DIR),
+            load_shard_models(MODEL_DIR),  # None unless trained with MODELING_SHARD_BY
+            None,
+        )
+    else:
+        loaded = (registered["model"], registered["pipeline"], registered["shard_models"], registered["version"])
+    with model_lock:
+        model, pipeline, shard_models, model_version = loaded
+        loaded_mtime = mtime
+
+def reload_if_changed():
+    """
+    Reload the model when the registry's CURRENT pointer changed since the last load (a new
+    training run or a rollback), so server workers pick it up without a restart. Costs one stat().
+    """
+    if current_mtime() == loaded_mtime:
+        return
+    with reload_lock:
+        if current_mtime() != loaded_mtime:
+            load_model()
+
+load_model()
 
 # ========================== Preprocessing Functions ==========================
-def feature_engineering_datetime(df):
-    """Extract useful datetime features for the model."""
-    df['Departure_Hour'] = df['Departure_Time'].dt.hour
-    df['Departure_DayOfWeek'] = df['Departure_Time'].dt.dayofweek
-    df['Days_Before_Departure'] = (df['Departure_Time'] - df['Scrape_Time']).dt.days
-    return df
-
 def preprocessing_input(df: pd.DataFrame):
-    """Preprocess user input data to match model training format."""
-    datetime_df = df[['Departure_Time', 'Scrape_Time']].copy()
-    datetime_df['Departure_Time'] = pd.to_datetime(datetime_df['Departure_Time'])
-    datetime_df['Scrape_Time'] = pd.to_datetime(datetime_df['Scrape_Time'])
-    df.drop(columns=['Departure_Location_Code', 'Departure_Time', 'Scrape_Time'], inplace=True)
-
-    # Numerical features
-    num_col_df = df.select_dtypes(exclude=['object'])
-    num_scaled = pd.DataFrame(index=df.index)
-    for col in num_col_df.columns:
-        num_scaled[col] = scaler[col].transform(df[[col]])[:, 0]
-
-    # Categorical features (excluding multi-label)
-    cat_col_df = df.select_dtypes(include=['object'])
-    X_cat = onehot_encoder.transform(cat_col_df.drop(columns=['Refund_Policy']))
-    encoded_columns = onehot_encoder.get_feature_names_out(cat_col_df.drop(columns=['Refund_Policy']).columns)
-    X_cat_df = pd.DataFrame(X_cat, columns=encoded_columns, index=df.index)
-
-    # Multi-label (Refund_Policy)
-    onehot_df = pd.DataFrame(label_binarizer.transform(df["Refund_Policy"]),
-                             columns=label_binarizer.classes_, index=df.index)
-
-    # Datetime features
-    datetime_df = feature_engineering_datetime(datetime_df)
-    datetime_df.drop(columns=['Departure_Time', 'Scrape_Time'], inplace=True)
-
-    # Combine all processed features
-    final_df = pd.concat([num_scaled, X_cat_df, onehot_df, datetime_df], axis=1)
-    final_df.columns = [unidecode(str(c)).strip().replace(" ", "_").replace(",", "") for c in final_df.columns]
-    return final_df
+    """Preprocess user input data with the feature pipeline fitted at training time."""
+    return pipeline.transform(df)
 
 # ========================== Prediction Function ==========================
 def predict_airfare(df):
     """Predict the airfare based on processed input data."""
     return model.predict(df)
 
+def predict_airfare_batch(df):
+    """
+    Predict the airfare of every row of a raw input frame (airline and arrival location
+    names) at once: one code lookup per table, one transform and one predict call
+    (per shard model when route/airline sub-models are deployed).
+    """
+    reload_if_changed()
+    with model_lock:
+        model_, pipeline_, shard_models_ = model, pipeline, shard_models
+    df = df.copy()
+    df["Airline_id"] = get_codes_from_sql(engine, "Airline_id", "Airline", "Airline", df["Airline_id"])
+    df["Arrival_Location_Code"] = get_codes_from_sql(engine, "AirportCode", "Airport", "Location", df["Arrival_Location_Code"])
+    df['Carry-on_Baggage'] = df['Carry-on_Baggage'].astype(np.float64)
+    df['Checked_Baggage'] = df['Checked_Baggage'].astype(np.float64)
+    X = pipeline_.transform(df)
+    y_pred = predict_with_shards(model_, shard_models_, X, df)
+    return pipeline_.inverse_transform_target(y_pred)
+
 def predict_airfare_real(df):
     """Predict the airfare based on processed input data."""
-    df["Airline_id"] = get_code_from_sql(engine, "Airline_id", "Airline", "Airline", df["Airline_id"].values[0])
-    df["Arrival_Location_Code"] = get_code_from_sql(engine, "AirportCode", "Airport", "Location", df["Arrival_Location_Code"].values[0])
-    df['Carry-on_Baggage'] = df['Carry-on_Baggage'].apply(lambda x: np.nan if x is None else x)
-    df['Checked_Baggage'] = df['Checked_Baggage'].apply(lambda x: np.nan if x is None else x)
-    X = preprocessing_input(df)
-    y_pred = model.predict(X)
-    pred_price = scaler['Total_Price'].inverse_transform(y_pred.reshape(1, -1))[0, 0]
-    return pred_price
+    return predict_airfare_batch(df)[0]
 
 if __name__ == "__main__":
     sample_input = {
@@ -0,0 +1,130 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import DateTime, bindparam, text
+from dotenv import load_dotenv
+from src.utils.db_utils import get_engine, qualified_table, quote, table_exists
+from src.etl.schema_migration import add_ticket_version_columns
+
+# ====================== Load environment variables ======================
+load_dotenv()
+
+# Store only new or changed fares (set FARE_DEDUP=0 to append every scraped row)
+FARE_DEDUP = os.getenv("FARE_DEDUP", "1") == "1"
+
+# Natural key of a fare and the attributes whose change creates a new version
+FARE_KEY = ['Flight Code', 'Departure Time', 'Departure Location Code', 'Airline_id', 'Fare Class', 'Passenger Type']
+FARE_ATTRIBUTES = ['Number of Tickets', 'Price per Ticket', 'Taxes & Fees', 'Total Price', 'Carry-on Baggage', 'Checked Baggage']
+
+# Columns added to TICKET: a version is valid from its 'Scrape Time' until 'Valid To' (NULL = current)
+VERSION_COLUMNS = ['Fare Hash', 'Valid To']
+
+
+def compute_fare_hash(df):
+    """Hash the fare attributes of each row into a signed 64-bit integer (fits BIGINT)."""
+    attributes = df[FARE_ATTRIBUTES].apply(pd.to_numeric, errors='coerce').astype('float64')
+    return pd.util.hash_pandas_object(attributes, index=False).values.view(np.int64)
+
+
+def load_current_versions(ticket_df, engine):
+    """
+    Read the latest stored (still open) version of every fare whose departure
+    falls inside the window of the new batch.
+    """
+    columns = FARE_KEY + ['Scrape Time', 'Fare Hash']
+    if not table_exists("TICKET", engine):
+        return pd.DataFrame(columns=columns)
+
+    add_ticket_version_columns(engine)
+    query = f"""
+        SELECT {", ".join(quote(engine, c) for c in columns)}
+        FROM {qualified_table(engine, "TICKET")}
+        WHERE {quote(engine, 'Valid To')} IS NULL
+            AND {quote(engine, 'Fare Hash')} IS NOT NULL
+            AND {quote(engine, 'Departure Time')} >= :min_departure
+            AND {quote(engine, 'Departure Time')} <= :max_departure
+    """
+    query = text(query).bindparams(
+        bindparam("min_departure", type_=DateTime()),
+        bindparam("max_departure", type_=DateTime()),
+    )
+    params = {
+        "min_departure": ticket_df['Departure Time'].min().to_pydatetime(),
+        "max_departure": ticket_df['Departure Time'].max().to_pydatetime(),
+    }
+    return pd.read_sql(query, engine, params=params)
+
+
+def detect_fare_changes(ticket_df, engine=None):
+    """
+    Compare scraped fares with the latest stored version of the same natural key.
+    Returns:
+    - new_versions_df: rows to append (new fares or fares whose attributes changed),
+      with 'Fare Hash' and 'Valid To' filled in
+    - superseded_df: key of stored versions to close, with the 'Valid To' to set
+    """
+    engine = engine or get_engine()
+    batch_df = ticket_df.copy()
+    batch_df['Fare Hash'] = compute_fare_hash(batch_df)
+    batch_df['Valid To'] = pd.NaT
+    batch_df['_stored'] = False
+
+    current_df = load_current_versions(batch_df, engine)
+    current_df['_stored'] = True
+    logging.info(f"Comparing {len(batch_df)} scraped fares with {len(current_df)} stored versions")
+
+    # Stored key values are kept as read (for the UPDATE); a parsed copy is used for matching
+    versions = pd.concat([current_df, batch_df], ignore_index=True) if not current_df.empty else batch_df.copy()
+    versions['_departure'] = pd.to_datetime(versions['Departure Time'])
+    versions['_scrape'] = pd.to_datetime(versions['Scrape Time'])
+    group_key = [c for c in FARE_KEY if c != 'Departure Time'] + ['_departure']
+    versions = versions.sort_values(group_key + ['_scrape', '_stored'], ascending=[True] * (len(group_key) + 1) + [False])
+
+    # Keep a row only if its hash differs from the previous version of the same fare
+    groups = versions.groupby(group_key, sort=False, dropna=False)
+    versions = versions[groups['Fare Hash'].shift().ne(versions['Fare Hash'])]
+
+    # Each kept version is valid until the next kept version of the same fare
+    next_scrape = versions.groupby(group_key, sort=False, dropna=False)['_scrape'].shift(-1)
+    versions = versions.assign(**{'Valid To': next_scrape})
+
+    new_versions_df = versions[~versions['_stored']]
+    superseded_df = versions[versions['_stored'] & versions['Valid To'].notna()][FARE_KEY + ['Valid To']]
+
+    unchanged = len(batch_df) - len(new_versions_df)
+    logging.info(
+        f"Fare change detection: {len(new_versions_df)} new/changed, {unchanged} unchanged skipped, "
+        f"{len(superseded_df)} stored version(s) superseded"
+    )
+    new_versions_df = new_versions_df[ticket_df.columns.tolist() + VERSION_COLUMNS].reset_index(drop=True)
+    return new_versions_df, superseded_df.reset_index(drop=True)
+
+
+def close_superseded_versions(superseded_df, engine=None):
+    """
+    Set 'Valid To' on stored versions that were replaced by a changed fare.
+    Must run before the new versions are appended.
+    """
+    if superseded_df.empty:
+        return
+    engine = engine or get_engine()
+    key_match = " AND ".join(f"{quote(engine, c)} = :k{i}" for i, c in enumerate(FARE_KEY))
+    query = text(f"""
+        UPDATE {qualified_table(engine, "TICKET")}
+        SET {quote(engine, 'Valid To')} = :valid_to
+        WHERE {key_match}
+            AND {quote(engine, 'Valid To')} IS NULL
+            AND {quote(engine, 'Scrape Time')} < :valid_to
+    """).bindparams(bindparam("valid_to", type_=DateTime()))
+
+    def to_param(value):
+        return value.to_pydatetime() if isinstance(value, pd.Timestamp) else value
+
+    params = [
+        {"valid_to": to_param(row[-1]), **{f"k{i}": to_param(v) for i, v in enumerate(row[:-1])}}
+        for row in superseded_df[FARE_KEY + ['Valid To']].itertuples(index=False, name=None)
+    ]
+    with engine.begin() as conn:
+        conn.execute(query, params)
+    logging.info(f"Closed {len(params)} superseded fare version(s)")
@@ -4,20 +4,34 @@ import json
 import pandas as pd
 import numpy as np
 import logging
+import argparse
 from datetime import datetime
 from dotenv import load_dotenv
 from src.utils.logger_utils import setup_logger
-from sqlalchemy import create_engine
+from src.utils.db_utils import get_columns, read_table, table_exists, write_table
 import sqlalchemy
 
 # Load environment variables
 load_dotenv()
 
+# 'incremental': clean and append only reviews not stored yet; 'full': rebuild every table
+REVIEW_ETL_MODE = os.getenv("REVIEW_ETL_MODE", "incremental")
+
+# Raw fields that identify a review (hashed into the stable 'review_key')
+REVIEW_KEY_COLUMNS = ['Airline', 'Rating', 'Title', 'Full Review', 'Information']
+
 # Paths
 RAW_PATH = "data/raw"
 CLEAN_PATH = "data/clean"
 os.makedirs(CLEAN_PATH, exist_ok=True)
 
+# Precompiled patterns (applied column-wise through the pandas .str accessor)
+RATING_PATTERN = re.compile(r"(\d\.\d) of")
+TRAVEL_DATE_PATTERN = re.compile(r"Date of travel: (.+)")
+TRAVEL_DATE_FORMAT = "%B %Y"
+WHITESPACE_PATTERN = re.compile(r"\s+")
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+
 
 # ---------------------------- TEXT DATA FUNCTIONS ---------------------------- #
 
@@ -27,6 +41,11 @@ def _extract_field(pattern, text):
     return match.group(1) if match else None
 
 
+def _extract_rating(series):
+    """Vectorized extraction of 'x.y of 5 bubbles' ratings; non-matching values become NaN."""
+    return series.astype("string").str.extract(RATING_PATTERN, expand=False).astype(float)
+
+
 def extract_info(original_path, file_name, airline_dict):
     """
     Extracts structured fields from a raw airline information text file 
@@ -78,6 +97,20 @@ def create_mention_df(airline_df):
     return df
 
 
+def _explode_dict_column(df, column, key_name, value_name):
+    """
+    Flatten a column of dicts into one (airline_id, key, value) row per item,
+    using a single explode instead of one DataFrame per row.
+    """
+    items = df[column].map(lambda d: list(d.items()))
+    exploded = df[['airline_id']].assign(**{column: items}).explode(column, ignore_index=True)
+    exploded = exploded.dropna(subset=[column])
+
+    final_df = pd.DataFrame(exploded[column].tolist(), columns=[key_name, value_name])
+    final_df.insert(0, 'airline_id', exploded['airline_id'].to_numpy())
+    return final_df
+
+
 def create_rating_df(airline_df):
     """
     Normalize ratings into a structured rating table.
@@ -87,16 +120,7 @@ def create_rating_df(airline_df):
     df['airline_id'] = df.index
     df.drop(columns='name', inplace=True)
 
-    sub_dfs = [
-        pd.DataFrame([{
-            'airline_id': row['airline_id'],
-            'rate_name': k,
-            'count': v
-        } for k, v in row['rating'].items()])
-        for _, row in df.iterrows()
-    ]
-
-    return pd.concat(sub_dfs, ignore_index=True)
+    return _explode_dict_column(df, 'rating', 'rate_name', 'count')
 
 
 def create_attribute_df(airline_df):
@@ -108,19 +132,8 @@ def create_attribute_df(airline_df):
     df['airline_id'] = df.index
     df.drop(columns='name', inplace=True)
 
-    sub_dfs = [
-        pd.DataFrame([{
-            'airline_id': row['airline_id'],
-            'attribute_name': k,
-            'rating': v
-        } for k, v in row['attributes'].items()])
-        for _, row in df.iterrows()
-    ]
-
-    final_df = pd.concat(sub_dfs, ignore_index=True)
-    final_df['rating'] = final_df['rating'].apply(
-        lambda x: float(re.search(r"(\d\.\d) of", x).group(1)) if isinstance(x, str) else None
-    )
+    final_df = _explode_dict_column(df, 'attributes', 'attribute_name', 'rating')
+    final_df['rating'] = _extract_rating(final_df['rating'])
     return final_df
 
 
@@ -175,16 +188,21 @@ def merge_all_airlines(*dfs):
 
 def extract_rating_column(df):
     """Extracts numeric rating from string."""
-    df['Rating'] = df['Rating'].apply(lambda x: float(re.search(r"(\d\.\d) of", x).group(1)))
+    df['Rating'] = _extract_rating(df['Rating'])
     return df
 
 
 def extract_date_information(df):
     """Extracts and converts travel date information from review text."""
     df.dropna(subset=['Information'], inplace=True)
-    df['Information'] = df['Information'].apply(
-        lambda x: datetime.strptime(re.search(r"Date of travel: (.+)", x).group(1), "%B %Y")
-    )
+    travel_date = df['Information'].str.extract(TRAVEL_DATE_PATTERN, expand=False)
+    try:
+        df['Information'] = pd.to_datetime(travel_date, format=TRAVEL_DATE_FORMAT)
+    except pd.errors.OutOfBoundsDatetime:
+        # Years outside the datetime64 range (e.g. Buddhist-calendar "2563") stay python datetimes,
+        # parsed once per distinct "Month YYYY" value
+        parsed = {d: datetime.strptime(d, TRAVEL_DATE_FORMAT) for d in travel_date.unique()}
+        df['Information'] = travel_date.map(parsed)
     return df
 
 
@@ -192,43 +210,53 @@ def preprocess(text):
     """Lowercases, strips, and removes punctuation from text."""
     if not isinstance(text, str):
         return ''
-    text = re.sub(r'\s+', ' ', text.lower())
-    text = re.sub(r'[^\w\s]', '', text)
+    text = WHITESPACE_PATTERN.sub(' ', text.lower())
+    text = PUNCTUATION_PATTERN.sub('', text)
     return text
 
 
+def preprocess_series(series):
+    """
+    Vectorized version of `preprocess` for a whole text column.
+    Each distinct text is cleaned once (titles repeat a lot), then mapped back.
+    """
+    codes, uniques = pd.factorize(series.astype(object))
+    text = pd.Series(uniques, dtype=object).str.lower()
+    text = text.str.replace(WHITESPACE_PATTERN, ' ', regex=True)
+    text = text.str.replace(PUNCTUATION_PATTERN, '', regex=True).fillna('')
+    cleaned = np.append(text.to_numpy(dtype=object), '')  # code -1 (missing) maps to ''
+    return pd.Series(cleaned[codes], index=series.index, dtype=object)
+
+
 def preprocess_text_information(df):
     """Preprocesses Title and Full Review fields."""
-    df['Title'] = df['Title'].apply(preprocess)
-    df['Full Review'] = df['Full Review'].apply(preprocess)
+    df['Title'] = preprocess_series(df['Title'])
+    df['Full Review'] = preprocess_series(df['Full Review'])
     return df
 
 
 def create_service_rating(df):
     """
     Extracts service-level rating breakdown from JSON in each review.
+    The whole column is parsed with a single json.loads call, exploded and flattened in bulk.
     """
     logging.info("🧩 Creating Service Rating table...")
-    service_df = df[['airline_id', 'Service Ratings', 'Information']].copy()
-    service_df.dropna(subset=['Service Ratings'], inplace=True)
-
-    service_df['Service Ratings'] = service_df['Service Ratings'].apply(
-        lambda x: json.loads(x.replace("'", "\""))
-    )
-
-    sub_dfs = [
-        pd.DataFrame([{
-            'airline_id': row['airline_id'],
-            'service_name': s['Service Info'],
-            'rating': s['Service Rating']
-        } for s in row['Service Ratings']])
-        for _, row in service_df.iterrows()
-    ]
-
-    final_df = pd.concat(sub_dfs, ignore_index=True)
-    final_df['rating'] = final_df['rating'].apply(
-        lambda x: float(re.search(r"(\d\.\d) of", x).group(1)) if isinstance(x, str) else None
-    )
+    id_columns = [c for c in ['airline_id', 'review_key'] if c in df.columns]
+    service_df = df[id_columns + ['Service Ratings']].dropna(subset=['Service Ratings'])
+    if service_df.empty:
+        return pd.DataFrame(columns=['airline_id', 'service_name', 'rating'] + id_columns[1:])
+
+    ratings_json = "[" + ",".join(service_df['Service Ratings'].str.replace("'", "\"", regex=False)) + "]"
+    exploded = service_df[id_columns].reset_index(drop=True).assign(**{
+        'Service Ratings': json.loads(ratings_json),
+    }).explode('Service Ratings', ignore_index=True).dropna(subset=['Service Ratings'])
+
+    flat_df = pd.json_normalize(exploded['Service Ratings'].tolist())
+    final_df = exploded[['airline_id']].reset_index(drop=True)
+    final_df['service_name'] = flat_df['Service Info'].to_numpy()
+    final_df['rating'] = _extract_rating(flat_df['Service Rating']).to_numpy()
+    if 'review_key' in id_columns:
+        final_df['review_key'] = exploded['review_key'].to_numpy()
     return final_df
 
 
@@ -240,9 +268,16 @@ def clean_review_data(df):
     return df
 
 
-def process_airline_review(vj, vna, bam):
+def compute_review_key(df):
+    """Stable content key of each raw review (signed 64-bit hash, fits BIGINT)."""
+    raw = df[REVIEW_KEY_COLUMNS].astype(str)
+    return pd.util.hash_pandas_object(raw, index=False).values.view(np.int64)
+
+
+def process_airline_review(vj, vna, bam, existing_keys=None):
     """
     Complete pipeline to clean and prepare airline review data.
+    When `existing_keys` is given, only reviews whose key is not in it are cleaned and returned.
     """
     logging.info("🚀 Starting review data processing pipeline...")
     vj = add_airline_name_column(vj, 'VietJetAir')
@@ -250,8 +285,16 @@ def process_airline_review(vj, vna, bam):
     bam = add_airline_name_column(bam, 'Bamboo Airways')
 
     full_df = merge_all_airlines(vj, vna, bam)
-    full_df = clean_review_data(full_df)
+    # Assigned on the whole corpus so ids stay the same when only new reviews are kept
     full_df['airline_id'] = full_df.groupby('Airline').ngroup()
+    full_df['review_key'] = compute_review_key(full_df)
+
+    if existing_keys is not None:
+        total = len(full_df)
+        full_df = full_df[~full_df['review_key'].isin(existing_keys)].drop_duplicates(subset='review_key')
+        logging.info(f"🆕 {len(full_df)} new review(s) out of {total} scraped")
+
+    full_df = clean_review_data(full_df)
 
     service_df = create_service_rating(full_df)
 
@@ -261,23 +304,41 @@ def process_airline_review(vj, vna, bam):
     return full_df, service_df
 
 
-def insert_into_sql_server(df, driver, server, database, username, password, mode, table_name):
+def insert_into_db(df, mode, table_name):
     """
-    Inserts a DataFrame into a SQL Server table using SQLAlchemy.
+    Inserts a DataFrame into the configured storage backend (SQL Server, DuckDB or SQLite).
     """
-    logging.info(f"💾 Inserting data into SQL Server table: {table_name}")
-    conn_str = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+{driver}+for+SQL+Server"
-    engine = create_engine(conn_str)
-
+    logging.info(f"💾 Inserting data into table: {table_name}")
     dtype = {col: sqlalchemy.types.NVARCHAR(length=1000) for col in df.select_dtypes(include='object').columns}
-    df.to_sql(name=table_name, con=engine, schema='dbo', if_exists=mode, index=False, dtype=dtype)
+    write_table(df, table_name, mode, dtype=dtype)
 
     logging.info(f"✅ Data inserted into table '{table_name}'.")
 
 
-def load(airline_info_df, mention_df, rating_df, attribute_df, full_df, service_df):
+def get_stored_review_keys():
     """
-    Loads data to cleaned CSV files and SQL Server.
+    Return the review keys already stored in AIRLINE_REVIEW, or None when the table
+    does not exist yet or was loaded before review keys were introduced.
+    """
+    if not table_exists("AIRLINE_REVIEW") or 'review_key' not in get_columns("AIRLINE_REVIEW"):
+        return None
+    return read_table("AIRLINE_REVIEW", columns=['review_key'])['review_key']
+
+
+def _write_csv(df, path, append):
+    """Write (or append, keeping a single header) a DataFrame to CSV."""
+    if append and os.path.exists(path):
+        df.to_csv(path, mode='a', header=False, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def load(airline_info_df, mention_df, rating_df, attribute_df, full_df, service_df, incremental=False):
+    """
+    Loads data to cleaned CSV files and the configured database.
+    The small airline-level tables are always replaced; in incremental mode the
+    review tables (AIRLINE_REVIEW, REVIEW_SERVICE) are appended to, so existing
+    reviews and their enrichments (e.g. Sentiment) stay in place.
     """
     logging.info("💾 Saving and loading data to destination...")
 
@@ -285,7 +346,7 @@ def load(airline_info_df, mention_df, rating_df, attribute_df, full_df, service_
     airline_info_df.to_csv(airline_info_path, index=False)
 
     full_review_path = os.path.join(CLEAN_PATH, "all_airlines_review_cleaned.csv")
-    full_df.to_csv(full_review_path, index=False)
+    _write_csv(full_df, full_review_path, incremental)
 
     output_dir = os.path.join(CLEAN_PATH, "review_airline")
     os.makedirs(output_dir, exist_ok=True)
@@ -293,33 +354,34 @@ def load(airline_info_df, mention_df, rating_df, attribute_df, full_df, service_
     mention_df.to_csv(os.path.join(output_dir, "mention.csv"), index=False)
     rating_df.to_csv(os.path.join(output_dir, "rating.csv"), index=False)
     attribute_df.to_csv(os.path.join(output_dir, "attribute.csv"), index=False)
-    service_df.to_csv(os.path.join(output_dir, "review_service.csv"), index=False)
+    _write_csv(service_df, os.path.join(output_dir, "review_service.csv"), incremental)
 
-    server = os.getenv("DB_SERVER")
-    database = os.getenv("DB_NAME")
-    username = os.getenv("DB_USER")
-    password = os.getenv("DB_PASSWORD")
-    driver = 17
     mode = 'replace'
+    review_mode = 'append' if incremental else 'replace'
 
-    insert_into_sql_server(mention_df, driver, server, database, username, password, mode, "MENTION")
-    insert_into_sql_server(rating_df, driver, server, database, username, password, mode, "RATING")
-    insert_into_sql_server(full_df, driver, server, database, username, password, mode, "AIRLINE_REVIEW")
-    insert_into_sql_server(airline_info_df, driver, server, database, username, password, mode, "INFO")
-    insert_into_sql_server(attribute_df, driver, server, database, username, password, mode, "ATTRIBUTE")
-    insert_into_sql_server(service_df, driver, server, database, username, password, mode, "REVIEW_SERVICE")
+    insert_into_db(mention_df, mode, "MENTION")
+    insert_into_db(rating_df, mode, "RATING")
+    insert_into_db(full_df, review_mode, "AIRLINE_REVIEW")
+    insert_into_db(airline_info_df, mode, "INFO")
+    insert_into_db(attribute_df, mode, "ATTRIBUTE")
+    insert_into_db(service_df, review_mode, "REVIEW_SERVICE")
 
 
-def main():
+def main(mode=REVIEW_ETL_MODE):
     """Main ETL entry point."""
     setup_logger(log_dir="logs")
-    logging.info("🛫 === STARTING ETL PROCESS ===")
+    logging.info(f"🛫 === STARTING ETL PROCESS ({mode}) ===")
 
     try:
+        existing_keys = get_stored_review_keys() if mode == 'incremental' else None
+        if mode == 'incremental' and existing_keys is None:
+            logging.warning("⚠️ No keyed AIRLINE_REVIEW table found, running a full load first.")
+        incremental = existing_keys is not None
+
         airline_info_df, mention_df, rating_df, attribute_df = process_airline_data()
         vj_review_df, vna_review_df, bam_review_df = extract_airline_review()
-        full_df, service_df = process_airline_review(vj_review_df, vna_review_df, bam_review_df)
-        load(airline_info_df, mention_df, rating_df, attribute_df, full_df, service_df)
+        full_df, service_df = process_airline_review(vj_review_df, vna_review_df, bam_review_df, existing_keys)
+        load(airline_info_df, mention_df, rating_df, attribute_df, full_df, service_df, incremental)
         logging.info("✅ === ETL PROCESS COMPLETED SUCCESSFULLY ===")
 
     except Exception as e:
@@ -327,6 +389,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Airline review ETL")
+    parser.add_argument("--mode", choices=["incremental", "full"], default=REVIEW_ETL_MODE,
+                        help="Append only new reviews (incremental) or rebuild every table (full)")
+    args = parser.parse_args()
+    main(mode=args.mode)
 
 # python -m src.etl.preprocessing_airline_review
\ No newline at end of file
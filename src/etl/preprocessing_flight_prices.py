@@ -2,11 +2,12 @@ import os
 import pandas as pd
 import numpy as np
 import logging
-import ast
 import json
 from dotenv import load_dotenv
 from src.utils.logger_utils import setup_logger
-from sqlalchemy import create_engine
+from src.utils.db_utils import read_table, table_exists, write_table
+from src.utils.refund_policy import parse_refund_policies
+from src.etl.fare_change_detection import FARE_DEDUP, close_superseded_versions, detect_fare_changes
 import sqlalchemy
 
 # Load environment variables from .env file
@@ -124,20 +125,9 @@ def parse_baggage_info(df):
 
 def parse_refund_policy(df):
     """
-    Parse refund policy string using literal_eval.
+    Parse refund policy string using literal_eval (once per distinct value).
     """
-    import ast
-
-    def safe_eval(x):
-        if pd.isna(x):
-            return []
-        try:
-            return ast.literal_eval(x)
-        except:
-            return []
-
-    # df['Refund Policy'] = df['Refund Policy'].apply(safe_eval)
-    df['Refund Policy'].apply(safe_eval)
+    parse_refund_policies(df['Refund Policy'])
     return df
 
 
@@ -200,7 +190,39 @@ def clean_data(df_to_han, df_to_dad):
     return df
 
 
-def normalize_tables(df):
+def read_stored_airlines(engine=None):
+    """(Airline_id, Airline) pairs already stored in AIRLINE (empty before the first load)."""
+    if not table_exists("AIRLINE", engine):
+        return pd.DataFrame(columns=['Airline_id', 'Airline'])
+    return read_table("AIRLINE", engine=engine, columns=['Airline_id', 'Airline'])
+
+
+def assign_airline_ids(airlines, stored_airlines=None):
+    """
+    Give every airline name a stable Airline_id: the id already stored for that name,
+    otherwise the next free "ALnnn" number. Ids are part of the ticket natural key, so
+    they must not change between runs. When the stored table maps one name to several ids
+    (or one id to several names), the lowest unused id per name wins.
+    """
+    ids = {}
+    if stored_airlines is not None and not stored_airlines.empty:
+        used = set()
+        for airline_id, airline in stored_airlines.drop_duplicates().sort_values(['Airline_id', 'Airline']).itertuples(index=False):
+            if airline not in ids and airline_id not in used:
+                ids[airline] = airline_id
+                used.add(airline_id)
+        numbers = pd.to_numeric(stored_airlines['Airline_id'].str[2:], errors='coerce')
+        next_number = int(numbers.max()) + 1 if numbers.notna().any() else 1
+    else:
+        next_number = 1
+    for airline in airlines:
+        if airline not in ids:
+            ids[airline] = f"AL{next_number:03d}"
+            next_number += 1
+    return pd.Series(airlines).map(ids)
+
+
+def normalize_tables(df, stored_airlines=None):
     """
     Normalize raw flat DataFrame into multiple dimension and fact tables:
     - airport_df: Dimension table for airports
@@ -224,7 +246,7 @@ def normalize_tables(df):
 
     logging.debug("Generating AIRLINE table...")
     airline_df = df[['Airline']].drop_duplicates().reset_index(drop=True)
-    airline_df['Airline_id'] = "AL" + (airline_df.index + 1).astype(str).str.zfill(3)
+    airline_df['Airline_id'] = assign_airline_ids(airline_df['Airline'], stored_airlines)
     airline_df = airline_df[['Airline_id', 'Airline']]
 
     tmp_df = df.drop(columns=['Departure Location', 'Arrival Location', 'Refund Policy']).drop_duplicates()
@@ -252,27 +274,24 @@ def normalize_tables(df):
     return airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df
 
 
-def transform(df_to_han, df_to_dad):
+def transform(df_to_han, df_to_dad, stored_airlines=None):
     """
     Transform raw flight data into normalized schema:
     - Clean data
-    - Generate normalized dimension & fact tables
+    - Generate normalized dimension & fact tables (reusing the stored airline ids)
     """
     logging.info("Starting transformation process...")
     df = clean_data(df_to_han, df_to_dad)
-    airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df = normalize_tables(df)
+    airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df = normalize_tables(df, stored_airlines)
 
     logging.info("Transformation completed.")
     return df, airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df
 
 
-def insert_into_sql_server(df, driver, server, database, username, password, mode, table_name):
+def insert_into_db(df, mode, table_name):
     """
-    Insert a DataFrame into SQL Server using SQLAlchemy engine.
+    Insert a DataFrame into the configured storage backend (SQL Server, DuckDB or SQLite).
     """
-    conn_str = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+{driver}+for+SQL+Server"
-    engine = create_engine(conn_str)
-
     dtype = {}
     for col in df.columns:
         if df[col].dtype == 'object':
@@ -280,8 +299,7 @@ def insert_into_sql_server(df, driver, server, database, username, password, mod
         if col == 'Refund Policy':
             dtype[col] = sqlalchemy.types.NVARCHAR(length=1000)
 
-    df.to_sql(name=table_name, con=engine, schema='dbo', if_exists=mode, index=False, dtype=dtype)
-    logging.info(f"Inserted table '{table_name}' into SQL Server.")
+    write_table(df, table_name, mode, dtype=dtype)
 
 def load_options(path):
     df = pd.read_csv(path, parse_dates=["Departure Time", "Arrival Time", "Scrape Time"])
@@ -298,11 +316,11 @@ def load_options(path):
 
 
     options_dict['Refund Policy'] = {}
-    df['Refund Policy'] = df['Refund Policy'].apply(lambda x: ast.literal_eval(x) if not pd.isna(x) else []).explode("Refund Policy")
+    df['Refund Policy'] = parse_refund_policies(df['Refund Policy'])
     for (airline, fareclass), row in df.explode("Refund Policy").groupby(['Airline', 'Fare Class'])['Refund Policy'].unique().items():
         if airline not in options_dict['Refund Policy']:
             options_dict['Refund Policy'][airline] = {}
-        options_dict['Refund Policy'][airline][fareclass]= [v.replace("- ", "") if not pd.isna(v) else None for v in row]
+        options_dict['Refund Policy'][airline][fareclass]= [v if not pd.isna(v) else None for v in row]
 
     options_dict['Baggage'] = {}
     for (airline, fareclass), row in df.groupby(['Airline', 'Fare Class'])['Carry-on Baggage'].unique().items():
@@ -324,7 +342,7 @@ def load_options(path):
 
 def load(df, airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df, data_dir=None):
     """
-    Load cleaned data to CSV files and insert into SQL Server database.
+    Load cleaned data to CSV files and insert into the configured database.
     """
 
     # Save combined cleaned data to CSV
@@ -344,19 +362,21 @@ def load(df, airport_df, airline_df, refund_policy_df, flight_schedule_df, ticke
 
     logging.info(f"Saved all normalized tables to: {data_dir}")
 
-    # Load to SQL Server
-    server = os.getenv("DB_SERVER")
-    database = os.getenv("DB_NAME")
-    username = os.getenv("DB_USER")
-    password = os.getenv("DB_PASSWORD")
-    driver = 17
+    # Load to database (backend selected by DB_BACKEND)
     mode = 'append'  # Options: 'fail', 'replace', 'append'
 
-    insert_into_sql_server(airport_df, driver, server, database, username, password, mode, "AIRPORT")
-    insert_into_sql_server(airline_df, driver, server, database, username, password, mode, "AIRLINE")
-    insert_into_sql_server(refund_policy_df, driver, server, database, username, password, mode, "REFUND_POLICY")
-    insert_into_sql_server(flight_schedule_df, driver, server, database, username, password, mode, "FLIGHT_SCHEDULE")
-    insert_into_sql_server(ticket_df, driver, server, database, username, password, mode, "TICKET")
+    insert_into_db(airport_df, mode, "AIRPORT")
+    insert_into_db(airline_df, mode, "AIRLINE")
+    insert_into_db(refund_policy_df, mode, "REFUND_POLICY")
+    insert_into_db(flight_schedule_df, mode, "FLIGHT_SCHEDULE")
+
+    if FARE_DEDUP:
+        # Only store fares that are new or changed since their latest stored version
+        ticket_df, superseded_df = detect_fare_changes(ticket_df)
+        close_superseded_versions(superseded_df)
+        insert_into_db(ticket_df, mode, "TICKET")
+    else:
+        insert_into_db(ticket_df, mode, "TICKET")
 
 
 def ETL(data_dir=None):
@@ -364,7 +384,7 @@ def ETL(data_dir=None):
     Main ETL execution flow:
     - Extract raw flight data
     - Transform and normalize
-    - Load to CSV and SQL Server
+    - Load to CSV and the configured database
     """
     logging.info("=== STARTING ETL PROCESS ===")
 
@@ -373,7 +393,9 @@ def ETL(data_dir=None):
         df_to_han, df_to_dad = extract(os.path.join(RAW_PATH, data_dir))
 
         # Transform
-        df, airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df = transform(df_to_han, df_to_dad)
+        df, airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df = transform(
+            df_to_han, df_to_dad, stored_airlines=read_stored_airlines()
+        )
 
         # # Load
         load(df, airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df, os.path.join(CLEAN_PATH, data_dir))
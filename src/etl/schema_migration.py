@@ -0,0 +1,141 @@
+import logging
+from sqlalchemy import text
+from dotenv import load_dotenv
+from src.utils.logger_utils import setup_logger
+from src.utils.db_utils import get_columns, get_engine, is_embedded, qualified_table, quote, table_exists
+
+# ====================== Load environment variables ======================
+load_dotenv()
+
+# Natural key shared by TICKET and FLIGHT_SCHEDULE
+FLIGHT_KEY = ['Flight Code', 'Departure Time', 'Departure Location Code']
+
+# SQL Server column types of the key (as created by pandas.to_sql in the ETL)
+FLIGHT_KEY_TYPES = {
+    'Flight Code': 'NVARCHAR(100)',
+    'Departure Time': 'DATETIME',
+    'Departure Location Code': 'NVARCHAR(100)',
+}
+
+# Fare version columns added to TICKET by the change-detection stage, per dialect
+TICKET_VERSION_COLUMN_TYPES = {
+    'Fare Hash': {"mssql": "BIGINT", "duckdb": "BIGINT", "sqlite": "BIGINT"},
+    'Valid To': {"mssql": "DATETIME", "duckdb": "TIMESTAMP", "sqlite": "DATETIME"},
+}
+
+# (index name, table, columns) supporting the retention job and the modeling join
+INDEXES = [
+    ("IX_TICKET_ScrapeTime", "TICKET", ['Scrape Time']),
+    ("IX_TICKET_FlightKey", "TICKET", FLIGHT_KEY),
+]
+
+
+def _column_list(engine, columns):
+    return ", ".join(quote(engine, c) for c in columns)
+
+
+def create_index(conn, engine, index_name, table_name, columns):
+    """Create a non-unique index if it does not exist yet."""
+    table = qualified_table(engine, table_name)
+    if is_embedded(engine):
+        query = f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({_column_list(engine, columns)})"
+    else:
+        query = f"""
+            IF NOT EXISTS (
+                SELECT 1 FROM sys.indexes
+                WHERE name = '{index_name}' AND object_id = OBJECT_ID('{table}')
+            )
+            CREATE NONCLUSTERED INDEX {index_name} ON {table} ({_column_list(engine, columns)})
+        """
+    conn.execute(text(query))
+    logging.info(f"Index {index_name} on {table_name}({', '.join(columns)}) is in place")
+
+
+def add_ticket_version_columns(engine=None):
+    """
+    Add the 'Fare Hash' and 'Valid To' columns used for fare validity intervals
+    to an existing TICKET table. Rows loaded before the migration keep NULLs.
+    """
+    engine = engine or get_engine()
+    if not table_exists("TICKET", engine):
+        return
+
+    existing = get_columns("TICKET", engine)
+    table = qualified_table(engine, "TICKET")
+    add_keyword = "ADD COLUMN" if is_embedded(engine) else "ADD"
+    with engine.begin() as conn:
+        for col, col_types in TICKET_VERSION_COLUMN_TYPES.items():
+            if col in existing:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} {add_keyword} {quote(engine, col)} {col_types[engine.dialect.name]} NULL"))
+            logging.info(f"Added column '{col}' to TICKET")
+
+
+def create_flight_schedule_key(conn, engine):
+    """
+    Enforce the flight natural key on FLIGHT_SCHEDULE.
+    - SQL Server: clustered primary key with IGNORE_DUP_KEY, so the daily
+      append of already-known flights is silently skipped instead of failing.
+    - Embedded backends: an index on the key (primary keys cannot be added to
+      an existing table there; duplicates are removed by the retention job).
+    """
+    table = qualified_table(engine, "FLIGHT_SCHEDULE")
+    if is_embedded(engine):
+        create_index(conn, engine, "IX_FLIGHT_SCHEDULE_FlightKey", "FLIGHT_SCHEDULE", FLIGHT_KEY)
+        return
+
+    exists = conn.execute(text(f"""
+        SELECT 1 FROM sys.key_constraints
+        WHERE type = 'PK' AND parent_object_id = OBJECT_ID('{table}')
+    """)).first()
+    if exists:
+        logging.info("Primary key on FLIGHT_SCHEDULE is in place")
+        return
+
+    # Key columns must be NOT NULL and unique before the primary key can be added
+    null_check = " OR ".join(f"{quote(engine, c)} IS NULL" for c in FLIGHT_KEY)
+    conn.execute(text(f"DELETE FROM {table} WHERE {null_check}"))
+    conn.execute(text(f"""
+        WITH CTE AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY {_column_list(engine, FLIGHT_KEY)} ORDER BY (SELECT NULL)) AS rn
+            FROM {table}
+        )
+        DELETE FROM CTE WHERE rn > 1
+    """))
+    for col, col_type in FLIGHT_KEY_TYPES.items():
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {quote(engine, col)} {col_type} NOT NULL"))
+
+    conn.execute(text(f"""
+        ALTER TABLE {table}
+        ADD CONSTRAINT PK_FLIGHT_SCHEDULE PRIMARY KEY CLUSTERED ({_column_list(engine, FLIGHT_KEY)})
+        WITH (IGNORE_DUP_KEY = ON)
+    """))
+    logging.info("Created primary key PK_FLIGHT_SCHEDULE on FLIGHT_SCHEDULE")
+
+
+def migrate_schema():
+    """
+    Create the indexes and keys used by the retention job and the modeling join.
+    Safe to run repeatedly; tables that do not exist yet are skipped.
+    """
+    logging.info("Running schema migration...")
+    engine = get_engine()
+    add_ticket_version_columns(engine)
+
+    with engine.begin() as conn:
+        for index_name, table_name, columns in INDEXES:
+            if table_exists(table_name, engine):
+                create_index(conn, engine, index_name, table_name, columns)
+            else:
+                logging.warning(f"Table {table_name} does not exist yet, skipping {index_name}")
+
+        if table_exists("FLIGHT_SCHEDULE", engine):
+            create_flight_schedule_key(conn, engine)
+        else:
+            logging.warning("Table FLIGHT_SCHEDULE does not exist yet, skipping its key")
+
+    logging.info("Schema migration completed.")
+
+if __name__ == "__main__":
+    setup_logger(log_dir="logs")
+    migrate_schema()
@@ -1,91 +1,157 @@
 import os
+import time
 import logging
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, text
 from dotenv import load_dotenv
 from src.utils.logger_utils import setup_logger
+from src.utils.db_utils import get_columns, get_engine, is_embedded, qualified_table, quote, read_query
+from src.etl.schema_migration import FLIGHT_KEY
+from src.etl.fare_change_detection import FARE_KEY
+from src.modeling.feature_store import expire_features, list_partitions
 
 # ====================== Load environment variables ======================
 load_dotenv()
-username = os.getenv("DB_USER")
-password = os.getenv("DB_PASSWORD")
-server = os.getenv("DB_SERVER")
-database = os.getenv("DB_NAME")
-driver = 17  # Default ODBC driver
+RETENTION_MONTHS = 3
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
 
+# Columns that identify a duplicate row in each dimension table
+DIMENSION_KEYS = {
+    "FLIGHT_SCHEDULE": FLIGHT_KEY,
+    "AIRPORT": ['AirportCode', 'Location'],
+    "AIRLINE": ['Airline_id', 'Airline'],
+    "REFUND_POLICY": ['Airline_id', 'Fare Class', 'Refund Policy'],
+}
+
+
+def remove_duplicates(conn, engine, table_name, key_columns):
+    """
+    Keep a single row per key in a dimension table.
+    SQL Server deletes through a ROW_NUMBER() CTE, embedded backends keep the lowest rowid.
+    """
+    table = qualified_table(engine, table_name)
+    keys = ", ".join(quote(engine, c) for c in key_columns)
+
+    if is_embedded(engine):
+        query = f"""
+            DELETE FROM {table}
+            WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY {keys})
+        """
+    else:
+        query = f"""
+            WITH CTE AS (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY (SELECT NULL)) AS rn
+                FROM {table}
+            )
+            DELETE FROM CTE WHERE rn > 1
+        """
+    conn.execute(text(query))
+    logging.info(f"Removed duplicates from {table_name}")
+
+
+def delete_in_batches(engine, table_name, condition, params=None, batch_size=RETENTION_BATCH_SIZE):
+    """
+    Delete rows matching `condition` in bounded batches, each batch in its own short
+    transaction, so the transaction log stays small and readers are only blocked briefly.
+    Returns a dict with the deleted row count, elapsed seconds and rows per second.
+    """
+    table = qualified_table(engine, table_name)
+    params = dict(params or {})
+    total_deleted = 0
+    start = time.perf_counter()
+
+    while True:
+        with engine.begin() as conn:
+            if is_embedded(engine):
+                # DuckDB does not report DELETE row counts, so select the batch by rowid first
+                rowids = conn.execute(
+                    text(f"SELECT rowid FROM {table} WHERE {condition} LIMIT {batch_size}"), params
+                ).scalars().all()
+                if rowids:
+                    delete_query = text(f"DELETE FROM {table} WHERE rowid IN :rowids")
+                    conn.execute(delete_query.bindparams(bindparam("rowids", expanding=True)), {"rowids": rowids})
+                deleted = len(rowids)
+            else:
+                result = conn.execute(text(f"DELETE TOP ({batch_size}) FROM {table} WHERE {condition}"), params)
+                deleted = max(result.rowcount or 0, 0)
+
+        total_deleted += deleted
+        logging.debug(f"Deleted batch of {deleted} row(s) from {table_name}")
+        if deleted < batch_size:
+            break
+
+    elapsed = time.perf_counter() - start
+    rows_per_sec = total_deleted / elapsed if elapsed > 0 else 0.0
+    logging.info(
+        f"Deleted {total_deleted} row(s) from {table_name} in {elapsed:.2f}s "
+        f"({rows_per_sec:.0f} rows/s, batch size {batch_size})"
+    )
+    return {"table": table_name, "deleted": total_deleted, "seconds": elapsed, "rows_per_sec": rows_per_sec}
+
+
+def ticket_retention_condition(engine):
+    """
+    WHERE clause (with a :cutoff_date parameter) of the tickets removed by retention.
+    Change detection keeps an unchanged fare as one open version with its first Scrape Time,
+    so an open version (NULL Valid To) is only removed once its flight departed before the
+    cutoff; closed versions go when their validity ended before the cutoff, and rows stored
+    without change detection (NULL Fare Hash) by Scrape Time as before.
+    """
+    condition = f"{quote(engine, 'Scrape Time')} <= :cutoff_date"
+    if 'Valid To' in get_columns("TICKET", engine):
+        condition += (
+            f" AND ({quote(engine, 'Fare Hash')} IS NULL"
+            f" OR {quote(engine, 'Valid To')} <= :cutoff_date"
+            f" OR {quote(engine, 'Departure Time')} <= :cutoff_date)"
+        )
+    return condition
 
 
 def delete_old_tickets_and_flights():
     """
-    1. Delete old tickets where Scrape Time is over 3 months.
+    1. Delete tickets older than 3 months (see ticket_retention_condition: current fare versions are
+       kept until their flight departed) and expire the matching feature store rows.
     2. Delete orphan flight schedules not referenced by any ticket.
-    3. Remove duplicates in dimension tables: AIRPORT, AIRLINE, REFUND_POLICY.
+    3. Remove duplicates in dimension tables: FLIGHT_SCHEDULE, AIRPORT, AIRLINE, REFUND_POLICY.
+    Steps 1-2 run in bounded batches (RETENTION_BATCH_SIZE rows per transaction).
     """
     try:
-        conn_str = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+{driver}+for+SQL+Server"
-        engine = create_engine(conn_str)
+        engine = get_engine()
+        ticket_table = qualified_table(engine, "TICKET")
+        flight_name = quote(engine, "FLIGHT_SCHEDULE")
 
         current_date = datetime.now()
-        cutoff_date = current_date - relativedelta(months=3)
+        cutoff_date = (current_date - relativedelta(months=RETENTION_MONTHS)).replace(microsecond=0)
         cutoff_str = cutoff_date.strftime('%Y-%m-%d %H:%M:%S')
         logging.info(f"Cutoff date for deletion: {cutoff_str}")
 
+        # Step 1: Delete old tickets (fare versions whose validity ended before the cutoff)
+        ticket_condition = ticket_retention_condition(engine)
+        delete_in_batches(engine, "TICKET", ticket_condition, {"cutoff_date": cutoff_str})
+        if list_partitions():
+            # Old tickets kept by retention keep their feature rows
+            key_columns = ", ".join(quote(engine, c) for c in FARE_KEY + ['Scrape Time'])
+            kept_keys = read_query(
+                f"SELECT {key_columns} FROM {ticket_table} WHERE {quote(engine, 'Scrape Time')} <= :cutoff_date",
+                {"cutoff_date": cutoff_str}, engine,
+            )
+            kept_keys.columns = [c.replace(" ", "_") for c in kept_keys.columns]
+            expire_features(cutoff_date, kept_keys)
+
+        # Step 2: Delete orphan flight schedules
+        key_match = " AND ".join(
+            f"t.{quote(engine, c)} = {flight_name}.{quote(engine, c)}" for c in FLIGHT_KEY
+        )
+        delete_in_batches(
+            engine, "FLIGHT_SCHEDULE",
+            f"NOT EXISTS (SELECT 1 FROM {ticket_table} t WHERE {key_match})",
+        )
+
+        # Step 3: Drop duplicates in FLIGHT_SCHEDULE, AIRPORT, AIRLINE, REFUND_POLICY
         with engine.begin() as conn:
-            # Step 1: Delete old tickets
-            delete_ticket_query = text("""
-                DELETE FROM dbo.TICKET
-                WHERE [Scrape Time] <= :cutoff_date
-            """)
-            ticket_result = conn.execute(delete_ticket_query, {"cutoff_date": cutoff_str})
-            logging.info(f"Deleted {ticket_result.rowcount or 0} old ticket(s)")
-
-            # Step 2: Delete orphan flight schedules
-            delete_flight_query = text("""
-                DELETE FROM dbo.FLIGHT_SCHEDULE
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM dbo.TICKET t
-                    WHERE 
-                        t.[Flight Code] = FLIGHT_SCHEDULE.[Flight Code]
-                        AND t.[Departure Time] = FLIGHT_SCHEDULE.[Departure Time]
-                        AND t.[Departure Location Code] = FLIGHT_SCHEDULE.[Departure Location Code]
-                )
-            """)
-            flight_result = conn.execute(delete_flight_query)
-            logging.info(f"Deleted {flight_result.rowcount or 0} orphan flight schedule(s)")
-
-            # Step 3: Drop duplicates in AIRPORT
-            conn.execute(text("""
-                WITH CTE AS (
-                    SELECT *, ROW_NUMBER() OVER (PARTITION BY AirportCode, Location ORDER BY (SELECT NULL)) AS rn
-                    FROM dbo.AIRPORT
-                )
-                DELETE FROM CTE WHERE rn > 1
-            """))
-            logging.info("Removed duplicates from AIRPORT")
-
-            # Step 4: Drop duplicates in AIRLINE
-            conn.execute(text("""
-                WITH CTE AS (
-                    SELECT *, ROW_NUMBER() OVER (PARTITION BY Airline_id, Airline ORDER BY (SELECT NULL)) AS rn
-                    FROM dbo.AIRLINE
-                )
-                DELETE FROM CTE WHERE rn > 1
-            """))
-            logging.info("Removed duplicates from AIRLINE")
-
-            # Step 5: Drop duplicates in REFUND_POLICY
-            conn.execute(text("""
-                WITH CTE AS (
-                    SELECT *, ROW_NUMBER() OVER (
-                        PARTITION BY Airline_id, [Fare Class], [Refund Policy]
-                        ORDER BY (SELECT NULL)
-                    ) AS rn
-                    FROM dbo.REFUND_POLICY
-                )
-                DELETE FROM CTE WHERE rn > 1
-            """))
-            logging.info("Removed duplicates from REFUND_POLICY")
+            for table_name, key_columns in DIMENSION_KEYS.items():
+                remove_duplicates(conn, engine, table_name, key_columns)
 
         logging.info("Data cleanup completed successfully.")
 
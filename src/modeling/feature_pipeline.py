@@ -0,0 +1,148 @@
+import os
+import joblib
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from unidecode import unidecode
+from sklearn.preprocessing import MultiLabelBinarizer, OneHotEncoder, StandardScaler
+from src.utils.refund_policy import factorize_refund_policies, multi_hot_from_codes
+
+# ========================== Directory Setup ==========================
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+MODEL_DIR = os.path.join(BASE_DIR, "models")
+
+# Bump when the fitted state or the output columns change, so stale artifacts are rejected
+PIPELINE_VERSION = 1
+PIPELINE_FILE = "feature_pipeline.pkl"
+
+# ========================== Input Columns ==========================
+NUMERIC_COLUMNS = ['Carry-on_Baggage', 'Checked_Baggage', 'Flight_Duration']
+CATEGORICAL_COLUMNS = ['Fare_Class', 'Airline_id', 'Arrival_Location_Code', 'Aircraft_Type']
+MULTILABEL_COLUMN = 'Refund_Policy'
+DATETIME_FEATURES = ['Departure_Hour', 'Departure_DayOfWeek', 'Days_Before_Departure']
+TARGET_COLUMN = 'Total_Price'
+
+
+def normalize_column_name(name):
+    """Column name as used by the models (ASCII, no spaces or commas)."""
+    return unidecode(str(name)).strip("- ").strip().replace(" ", "_").replace(",", "")
+
+
+def datetime_features(df):
+    """Departure hour, day of week and days between scrape and departure."""
+    departure = pd.to_datetime(df['Departure_Time'])
+    scrape = pd.to_datetime(df['Scrape_Time'])
+    return np.column_stack([
+        departure.dt.hour,
+        departure.dt.dayofweek,
+        (departure - scrape).dt.days,
+    ]).astype(np.float64)
+
+
+class FeaturePipeline:
+    """
+    Fitted preprocessing shared by training and inference: scales the numeric columns,
+    one-hot encodes the categorical columns, multi-hot encodes the refund policy and
+    derives the datetime features, always in the fixed `feature_names_` order.
+    """
+
+    def __init__(self, sparse=False):
+        self.sparse = sparse
+        self.version = PIPELINE_VERSION
+
+    def fit(self, df):
+        """Fit the scalers and encoders on the cleaned modeling frame (including the target)."""
+        logging.info(f"Fitting feature pipeline on {len(df)} rows...")
+        return self.fit_chunks([df])
+
+    def fit_chunks(self, chunks):
+        """
+        Fit on an iterable of cleaned chunks without holding them together: the scalers are
+        fitted incrementally and the encoders on the distinct values seen in any chunk, which
+        gives the same categories and columns as fitting on the concatenated frame.
+        """
+        self.numeric_scaler_ = StandardScaler()
+        self.target_scaler_ = StandardScaler()
+        categories = {c: [] for c in CATEGORICAL_COLUMNS}
+        policies = set()
+        for df in chunks:
+            self.numeric_scaler_.partial_fit(df[NUMERIC_COLUMNS])
+            self.target_scaler_.partial_fit(df[[TARGET_COLUMN]].to_numpy(dtype=np.float64))
+            for c in CATEGORICAL_COLUMNS:
+                categories[c].append(df[c].drop_duplicates())
+            policies.update(factorize_refund_policies(df[MULTILABEL_COLUMN])[1])
+
+        if not any(categories.values()):
+            raise ValueError("No rows to fit the feature pipeline on.")
+
+        # One row per distinct value (shorter columns padded with their first value)
+        distinct = [pd.concat(values, ignore_index=True).drop_duplicates() for values in categories.values()]
+        n_rows = max(len(values) for values in distinct)
+        distinct = pd.DataFrame({
+            c: np.concatenate([values.to_numpy(dtype=object), np.repeat(values.to_numpy(dtype=object)[:1], n_rows - len(values))])
+            for c, values in zip(CATEGORICAL_COLUMNS, distinct)
+        })
+        self.onehot_encoder_ = OneHotEncoder(sparse_output=True, handle_unknown='ignore', dtype=np.uint8)
+        self.onehot_encoder_.fit(distinct)
+        self.label_binarizer_ = MultiLabelBinarizer(sparse_output=True).fit(sorted(policies))
+
+        columns = (
+            NUMERIC_COLUMNS
+            + list(self.onehot_encoder_.get_feature_names_out(CATEGORICAL_COLUMNS))
+            + list(self.label_binarizer_.classes_)
+            + DATETIME_FEATURES
+        )
+        self.feature_names_ = [normalize_column_name(c) for c in columns]
+        return self
+
+    def transform(self, df):
+        """
+        Build the model input: a CSR matrix when the pipeline is sparse,
+        otherwise a DataFrame with `feature_names_` columns.
+        """
+        numeric = self.numeric_scaler_.transform(df[NUMERIC_COLUMNS])
+        binary = sp.hstack([
+            self.onehot_encoder_.transform(df[CATEGORICAL_COLUMNS]),
+            multi_hot_from_codes(*factorize_refund_policies(df[MULTILABEL_COLUMN]), self.label_binarizer_),
+        ], format='csr', dtype=np.uint8)
+        dates = datetime_features(df)
+
+        if self.sparse:
+            return sp.hstack([sp.csr_matrix(numeric), binary, sp.csr_matrix(dates)], format='csr', dtype=np.float64)
+        blocks = [pd.DataFrame(numeric), pd.DataFrame(binary.toarray()), pd.DataFrame(dates)]
+        X = pd.concat(blocks, axis=1, ignore_index=True)
+        X.columns = self.feature_names_
+        X.index = df.index
+        return X
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    def transform_target(self, y):
+        """Scale the target (Total_Price) as the models are trained on it."""
+        return self.target_scaler_.transform(np.asarray(y, dtype=np.float64).reshape(-1, 1))[:, 0]
+
+    def inverse_transform_target(self, y):
+        """Map scaled predictions back to prices."""
+        return self.target_scaler_.inverse_transform(np.asarray(y, dtype=np.float64).reshape(-1, 1))[:, 0]
+
+
+def save_pipeline(pipeline, model_dir=None):
+    """Save the fitted pipeline as a single artifact."""
+    path = os.path.join(model_dir or MODEL_DIR, PIPELINE_FILE)
+    joblib.dump(pipeline, path)
+    logging.info(f"Feature pipeline v{pipeline.version} saved to: {path}")
+    return path
+
+
+def load_pipeline(model_dir=None):
+    """Load the fitted pipeline, refusing artifacts written by another pipeline version."""
+    path = os.path.join(model_dir or MODEL_DIR, PIPELINE_FILE)
+    pipeline = joblib.load(path)
+    if getattr(pipeline, "version", None) != PIPELINE_VERSION:
+        raise ValueError(
+            f"Feature pipeline at {path} has version {getattr(pipeline, 'version', None)}, "
+            f"expected {PIPELINE_VERSION}. Re-run preprocess_data_for_modeling."
+        )
+    return pipeline
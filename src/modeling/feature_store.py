@@ -0,0 +1,219 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+from datetime import datetime, timedelta
+import pandas as pd
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from src.etl.fare_change_detection import FARE_KEY
+
+# ========================== Directory Setup ==========================
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+
+# ========================== Load Environment Variables ==========================
+load_dotenv()
+
+# MODELING_FEATURE_STORE=1 makes preprocessing incremental: feature rows are computed
+# only for newly scraped tickets and appended to a Parquet store partitioned by scrape date
+MODELING_FEATURE_STORE = os.getenv("MODELING_FEATURE_STORE", "0") == "1"
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", os.path.join(BASE_DIR, "data", "feature_store"))
+
+# Refit the feature pipeline and rebuild the whole store after this many days,
+# so categories first seen after the last rebuild get their own columns
+FEATURE_STORE_REFIT_DAYS = int(os.getenv("FEATURE_STORE_REFIT_DAYS", "7"))
+
+# A feature row is identified by the ticket natural key and its scrape time
+FEATURE_KEY = [c.replace(" ", "_") for c in FARE_KEY + ['Scrape Time']]
+PARTITION_PREFIX = "scrape_date="
+MANIFEST_FILE = "_manifest.json"
+
+
+def file_hash(path):
+    """SHA-256 of a file, used to tie the stored features to the pipeline artifact that computed them."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# ========================== Manifest ==========================
+def read_manifest(store_dir=None):
+    """Return the store manifest (pipeline hash, columns, build time) or None if there is no store."""
+    path = os.path.join(store_dir or FEATURE_STORE_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(pipeline_path, columns, store_dir=None):
+    manifest = {
+        "pipeline_hash": file_hash(pipeline_path),
+        "columns": list(columns),
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(store_dir or FEATURE_STORE_DIR, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def is_store_current(pipeline_path, store_dir=None, refit_days=FEATURE_STORE_REFIT_DAYS):
+    """
+    True when the store was built by the pipeline artifact at `pipeline_path` less than
+    `refit_days` ago, i.e. new rows can be appended with that pipeline.
+    """
+    manifest = read_manifest(store_dir)
+    if manifest is None:
+        logging.info("No feature store found.")
+        return False
+    if not os.path.exists(pipeline_path) or file_hash(pipeline_path) != manifest["pipeline_hash"]:
+        logging.info("Feature store was built by another feature pipeline.")
+        return False
+    if datetime.now() - datetime.fromisoformat(manifest["built_at"]) > timedelta(days=refit_days):
+        logging.info(f"Feature store is older than {refit_days} day(s).")
+        return False
+    return True
+
+# ========================== Partitions ==========================
+def list_partitions(store_dir=None):
+    """Return (scrape date, partition directory) pairs, oldest first."""
+    store_dir = store_dir or FEATURE_STORE_DIR
+    if not os.path.isdir(store_dir):
+        return []
+    partitions = [
+        (datetime.strptime(name[len(PARTITION_PREFIX):], "%Y-%m-%d").date(), os.path.join(store_dir, name))
+        for name in os.listdir(store_dir) if name.startswith(PARTITION_PREFIX)
+    ]
+    return sorted(partitions)
+
+
+def partition_files(partition_dir):
+    """Part files of a partition in write order (file names start with the run timestamp)."""
+    return [os.path.join(partition_dir, name) for name in sorted(os.listdir(partition_dir)) if name.endswith(".parquet")]
+
+
+def write_features(df, store_dir=None, run_id=None):
+    """
+    Append feature rows to the store, one Parquet part file per scrape date.
+    Each file is written under a temporary name and renamed, so readers never see partial files.
+    """
+    store_dir = store_dir or FEATURE_STORE_DIR
+    run_id = run_id or datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    for scrape_date, part in df.groupby(df['Scrape_Time'].dt.date, sort=True):
+        partition_dir = os.path.join(store_dir, f"{PARTITION_PREFIX}{scrape_date:%Y-%m-%d}")
+        os.makedirs(partition_dir, exist_ok=True)
+        path = os.path.join(partition_dir, f"part-{run_id}.parquet")
+        part.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+    logging.info(f"Wrote {len(df)} feature row(s) to {store_dir}")
+
+
+def get_watermark(store_dir=None):
+    """Latest scrape time in the store (read from the newest partition only), or None if empty."""
+    for _, partition_dir in reversed(list_partitions(store_dir)):
+        files = partition_files(partition_dir)
+        if files:
+            return max(pd.read_parquet(path, columns=['Scrape_Time'])['Scrape_Time'].max() for path in files)
+    return None
+
+
+def count_features_by_date(store_dir=None):
+    """Number of stored feature rows per scrape date (from the Parquet footers, no data is read)."""
+    return {
+        scrape_date: sum(pq.read_metadata(path).num_rows for path in partition_files(partition_dir))
+        for scrape_date, partition_dir in list_partitions(store_dir)
+    }
+
+
+def iter_features(scrape_from=None, columns=None, store_dir=None):
+    """
+    Stream the stored feature rows (optionally only those scraped from `scrape_from` on)
+    one part file at a time, ordered by scrape date and write order.
+    """
+    for scrape_date, partition_dir in list_partitions(store_dir):
+        if scrape_from is not None and scrape_date < scrape_from.date():
+            continue
+        for path in partition_files(partition_dir):
+            part = pd.read_parquet(path, columns=None if columns is None else list(dict.fromkeys(list(columns) + ['Scrape_Time'])))
+            if scrape_from is not None:
+                part = part[part['Scrape_Time'] >= scrape_from]
+            yield part if columns is None or 'Scrape_Time' in columns else part.drop(columns='Scrape_Time')
+
+
+def read_features(scrape_from=None, columns=None, store_dir=None):
+    """
+    Read the stored feature rows (optionally only those scraped from `scrape_from` on),
+    ordered by scrape time as written.
+    """
+    frames = list(iter_features(scrape_from, columns, store_dir))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def replace_partitions(staged_dir, scrape_dates, store_dir=None):
+    """
+    Replace the partitions of `scrape_dates` with those written to `staged_dir`
+    (a date with no staged partition is removed), then drop `staged_dir`.
+    """
+    store_dir = store_dir or FEATURE_STORE_DIR
+    for scrape_date in scrape_dates:
+        name = f"{PARTITION_PREFIX}{scrape_date:%Y-%m-%d}"
+        partition_dir, staged = os.path.join(store_dir, name), os.path.join(staged_dir, name)
+        shutil.rmtree(partition_dir, ignore_errors=True)
+        if os.path.isdir(staged):
+            os.replace(staged, partition_dir)
+    shutil.rmtree(staged_dir, ignore_errors=True)
+
+
+def swap_store(new_dir, store_dir=None):
+    """Replace the store with a freshly built one (built next to it in `new_dir`)."""
+    store_dir = store_dir or FEATURE_STORE_DIR
+    old_dir = store_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(new_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+# ========================== Retention ==========================
+def expire_features(cutoff_date, kept_keys, store_dir=None):
+    """
+    Drop the feature rows of the tickets removed by the TICKET retention. Retention keeps some
+    tickets scraped on or before `cutoff_date` (current fare versions of flights not departed yet),
+    so those rows are only kept when their ticket is in `kept_keys`, the FEATURE_KEY columns of
+    the old tickets left in TICKET. Partitions left empty are removed.
+    Returns the number of removed rows.
+    """
+    kept_keys = kept_keys[FEATURE_KEY].copy()
+    for c in ['Departure_Time', 'Scrape_Time']:
+        kept_keys[c] = pd.to_datetime(kept_keys[c], errors='coerce')
+    kept_index = pd.MultiIndex.from_frame(kept_keys)
+    kept_dates = set(kept_keys['Scrape_Time'].dt.date.dropna())
+
+    removed = 0
+    for scrape_date, partition_dir in list_partitions(store_dir):
+        if scrape_date > cutoff_date.date():
+            break
+        if scrape_date < cutoff_date.date() and scrape_date not in kept_dates:
+            removed += sum(pq.read_metadata(path).num_rows for path in partition_files(partition_dir))
+            shutil.rmtree(partition_dir)
+            continue
+        for path in partition_files(partition_dir):
+            part = pd.read_parquet(path)
+            keep = (part['Scrape_Time'] > cutoff_date) | pd.MultiIndex.from_frame(part[FEATURE_KEY]).isin(kept_index)
+            if keep.all():
+                continue
+            removed += int((~keep).sum())
+            if not keep.any():
+                os.remove(path)
+            else:
+                part[keep].to_parquet(path + ".tmp", index=False)
+                os.replace(path + ".tmp", path)
+        if not partition_files(partition_dir):
+            shutil.rmtree(partition_dir)
+    if removed:
+        logging.info(f"Expired {removed} feature row(s) of tickets removed by retention (cutoff {cutoff_date:%Y-%m-%d})")
+    return removed
@@ -0,0 +1,171 @@
+import os
+import json
+import shutil
+import joblib
+import logging
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from src.modeling.feature_pipeline import PIPELINE_FILE, load_pipeline
+from src.modeling.shard_models import SHARD_MODELS_FILE, load_shard_models
+
+# ========================== Load Environment Variables ==========================
+load_dotenv()
+
+# ========================== Directory Setup ==========================
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+
+# Local model registry:
+#   versions/<version>/  final_best_model.pkl, feature_pipeline.pkl, shard_models.pkl (optional),
+#                        metadata.json (metrics, data fingerprint, ...); never modified once published
+#   CURRENT              name of the version served by inference, replaced atomically
+# A version directory is built under a temporary name and renamed into place, so readers
+# never see half-written pickles. Only the newest MODEL_REGISTRY_KEEP versions are kept.
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(BASE_DIR, "models", "registry"))
+MODEL_REGISTRY_KEEP = int(os.getenv("MODEL_REGISTRY_KEEP", "10"))
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+MODEL_FILE = "final_best_model.pkl"
+METADATA_FILE = "metadata.json"
+
+
+def version_dir(version, registry_dir=None):
+    return os.path.join(registry_dir or MODEL_REGISTRY_DIR, VERSIONS_DIR, version)
+
+
+def list_versions(registry_dir=None):
+    """Published versions, oldest first (version names sort by creation time)."""
+    root = os.path.join(registry_dir or MODEL_REGISTRY_DIR, VERSIONS_DIR)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if not name.startswith("."))
+
+
+def current_version(registry_dir=None):
+    path = os.path.join(registry_dir or MODEL_REGISTRY_DIR, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def current_mtime(registry_dir=None):
+    """Modification time (ns) of CURRENT, or None; changes whenever a version is published or rolled back to."""
+    try:
+        return os.stat(os.path.join(registry_dir or MODEL_REGISTRY_DIR, CURRENT_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def set_current(version, registry_dir=None):
+    """Point CURRENT at a published version (atomic replace)."""
+    registry_dir = registry_dir or MODEL_REGISTRY_DIR
+    if not os.path.isdir(version_dir(version, registry_dir)):
+        raise ValueError(f"Model version {version} not found in {registry_dir}")
+    tmp_path = os.path.join(registry_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(registry_dir, CURRENT_FILE))
+    logging.info(f"Current model version: {version}")
+
+
+def read_metadata(version, registry_dir=None):
+    with open(os.path.join(version_dir(version, registry_dir), METADATA_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+# ========================== Publish ==========================
+def register_model(model, pipeline_path, metadata, shard_models=None, registry_dir=None, keep=MODEL_REGISTRY_KEEP):
+    """
+    Publish a trained model with the feature pipeline it was trained with, its shard models
+    and `metadata` (metrics, data fingerprint, ...) as a new version, and make it current.
+    """
+    registry_dir = registry_dir or MODEL_REGISTRY_DIR
+    version = datetime.now().strftime("%Y%m%d-%H%M%S")
+    existing = set(list_versions(registry_dir))
+    suffix = 1
+    while version in existing:
+        version = f"{version.split('.')[0]}.{suffix}"
+        suffix += 1
+
+    final_dir = version_dir(version, registry_dir)
+    tmp_dir = os.path.join(os.path.dirname(final_dir), f".{version}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    # Uncompressed pickles, so their numpy arrays can be memory-mapped on load
+    joblib.dump(model, os.path.join(tmp_dir, MODEL_FILE))
+    shutil.copy2(pipeline_path, os.path.join(tmp_dir, PIPELINE_FILE))
+    if shard_models and shard_models["shards"]:
+        joblib.dump(shard_models, os.path.join(tmp_dir, SHARD_MODELS_FILE))
+    with open(os.path.join(tmp_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump({"version": version, "created_at": datetime.now().isoformat(timespec="seconds"), **metadata}, f, indent=2)
+    os.replace(tmp_dir, final_dir)
+    logging.info(f"Model version {version} registered in: {final_dir}")
+
+    set_current(version, registry_dir)
+    prune_versions(keep, registry_dir)
+    return version
+
+
+def prune_versions(keep=MODEL_REGISTRY_KEEP, registry_dir=None):
+    """Remove the oldest versions beyond `keep` (never the current one)."""
+    current = current_version(registry_dir)
+    versions = list_versions(registry_dir)
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version != current:
+            shutil.rmtree(version_dir(version, registry_dir))
+            logging.info(f"Pruned model version {version}")
+
+
+def rollback(version=None, registry_dir=None):
+    """Make `version` (default: the version published before the current one) current again."""
+    versions = list_versions(registry_dir)
+    if version is None:
+        current = current_version(registry_dir)
+        older = [v for v in versions if current is None or v < current]
+        if not older:
+            raise ValueError("No earlier model version to roll back to.")
+        version = older[-1]
+    set_current(version, registry_dir)
+    return version
+
+# ========================== Load ==========================
+def load_model_version(version=None, registry_dir=None, mmap_mode="r"):
+    """
+    Load the model, feature pipeline and shard models of `version` (default: current).
+    With mmap_mode="r" the numpy arrays in the pickles are memory-mapped read-only, so
+    several server workers share the same pages. Returns None if nothing is registered.
+    """
+    version = version or current_version(registry_dir)
+    if version is None:
+        return None
+    path = version_dir(version, registry_dir)
+    return {
+        "version": version,
+        "model": joblib.load(os.path.join(path, MODEL_FILE), mmap_mode=mmap_mode),
+        "pipeline": load_pipeline(path),
+        "shard_models": load_shard_models(path, mmap_mode=mmap_mode),
+        "metadata": read_metadata(version, registry_dir),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local model registry")
+    parser.add_argument("command", choices=["list", "rollback"])
+    parser.add_argument("--version", help="Version to roll back to (default: the one before current)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "rollback":
+        rollback(args.version)
+        return
+    current = current_version()
+    for version in list_versions():
+        metadata = read_metadata(version)
+        print(
+            f"{'*' if version == current else ' '} {version:18} {metadata.get('model_name', ''):15} "
+            f"{metadata.get('training', ''):12} R2 {metadata.get('test_r2', float('nan')):.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
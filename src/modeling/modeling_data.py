@@ -1,13 +1,20 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
+import json
 import joblib
+import time
 import logging
-from unidecode import unidecode
-from sklearn.model_selection import train_test_split, KFold, GridSearchCV
+from joblib import Parallel, delayed, parallel_config
+from datetime import datetime, timedelta
+import scipy.sparse as sp
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split, KFold, GridSearchCV, ParameterSampler, cross_val_score
 from sklearn.linear_model import LinearRegression, Ridge
 from sklearn.ensemble import RandomForestRegressor
 from xgboost import XGBRegressor
+import lightgbm as lgb
 from lightgbm import LGBMRegressor
 from sklearn.metrics import (
     mean_absolute_error,
@@ -17,16 +24,122 @@ from sklearn.metrics import (
 )
 
 from src.utils.logger_utils import setup_logger
+from src.modeling.feature_pipeline import PIPELINE_FILE, TARGET_COLUMN, load_pipeline
+from src.modeling.training_dataset import load_training_dataset, save_training_dataset
+from src.modeling.shard_models import MODELING_SHARD_BY, SHARD_MODELS_FILE, save_shard_models, train_shard_models
+from src.modeling.model_registry import register_model
+from src.modeling.feature_store import MODELING_FEATURE_STORE, file_hash, get_watermark, iter_features, read_features
 
 # ========================== Directory Setup ==========================
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 MODEL_DIR = os.path.join(BASE_DIR, "models")
+MODELING_DATA_DIR = os.path.join(DATA_DIR, "data_for_modeling")
+
+# MODELING_SPARSE=1 trains on CSR features (used when reading the feature store;
+# binary datasets record their own format)
+MODELING_SPARSE = os.getenv("MODELING_SPARSE", "0") == "1"
+
+# Training dataset written by preprocess_for_modeling: "npy" (memory-mapped) or "csv" (legacy data.csv)
+MODELING_DATA_FORMAT = os.getenv("MODELING_DATA_FORMAT", "npy").lower()
+
+# Scrape-time window (days back from now) read from the feature store; unset = all stored rows
+MODELING_WINDOW_DAYS = int(os.getenv("MODELING_WINDOW_DAYS")) if os.getenv("MODELING_WINDOW_DAYS") else None
+
+# Parallel model selection: (model, fold) jobs run in MODELING_CV_JOBS worker processes
+# (1 = sequential, 0 = one per core); the cores are split evenly between the workers
+MODELING_CV_JOBS = int(os.getenv("MODELING_CV_JOBS", "1"))
+
+# Budget-aware tuning of the best CV candidate (MODELING_TUNING=0 disables it):
+# successive halving over PARAM_GRIDS within MODELING_TUNING_BUDGET seconds and/or
+# MODELING_TUNING_TRIALS candidates, then early stopping for the boosted models
+MODELING_TUNING = os.getenv("MODELING_TUNING", "1") == "1"
+MODELING_TUNING_BUDGET = float(os.getenv("MODELING_TUNING_BUDGET", "600"))
+MODELING_TUNING_TRIALS = int(os.getenv("MODELING_TUNING_TRIALS")) if os.getenv("MODELING_TUNING_TRIALS") else None
+MODELING_MAX_ESTIMATORS = int(os.getenv("MODELING_MAX_ESTIMATORS", "1000"))
+EARLY_STOPPING_ROUNDS = 20
+HALVING_FACTOR = 3
+
+# Incremental training (needs MODELING_FEATURE_STORE=1): XGBoost/LightGBM models are warm-started
+# with MODELING_INCREMENTAL_ESTIMATORS new rounds on the rows scraped since the last run; a full
+# retrain runs every MODELING_FULL_RETRAIN_DAYS days or when the feature pipeline is refit, and an
+# update is rejected if its held-out R2 drops by more than MODELING_REGRESSION_TOLERANCE
+MODELING_INCREMENTAL = os.getenv("MODELING_INCREMENTAL", "0") == "1"
+MODELING_INCREMENTAL_ESTIMATORS = int(os.getenv("MODELING_INCREMENTAL_ESTIMATORS", "50"))
+MODELING_FULL_RETRAIN_DAYS = int(os.getenv("MODELING_FULL_RETRAIN_DAYS", "7"))
+MODELING_REGRESSION_TOLERANCE = float(os.getenv("MODELING_REGRESSION_TOLERANCE", "0.005"))
+# Each update also replays MODELING_REPLAY_RATIO x (new rows) rows sampled from the training
+# set of the last full retrain, so the added rounds do not forget the older data
+MODELING_REPLAY_RATIO = float(os.getenv("MODELING_REPLAY_RATIO", "1.0"))
+MODELING_REPLAY_ROWS = int(os.getenv("MODELING_REPLAY_ROWS", "20000"))
+WARM_START_MODELS = {"XGBoost", "LightGBM"}
+TRAINING_STATE_FILE = "training_state.json"
+HOLDOUT_DIR = os.path.join(MODEL_DIR, "holdout")
+REPLAY_DIR = os.path.join(MODEL_DIR, "replay")
+
+# CV results are cached per (training data hash, model class/params, folds) in CV_CACHE_DIR,
+# so reruns on unchanged data skip the candidates already evaluated (MODELING_CV_CACHE=0 disables it)
+MODELING_CV_CACHE = os.getenv("MODELING_CV_CACHE", "1") == "1"
+CV_CACHE_DIR = os.getenv("CV_CACHE_DIR", os.path.join(MODEL_DIR, "cv_cache"))
+CV_SEED = 42
+
+# Candidates trained directly on CSR input; the others (RandomForest, whose sparse
+# splitter is several times slower) get a dense copy of each fold
+SPARSE_NATIVE_MODELS = {"LinearRegression", "Ridge", "XGBoost", "LightGBM"}
+
+# ========================== Feature Matrix Helpers ==========================
+def take_rows(X, idx):
+    """Select rows by position from a DataFrame/Series, an array or a CSR matrix."""
+    return X.iloc[idx] if hasattr(X, "iloc") else X[idx]
+
+def stack_rows(parts):
+    """Concatenate row blocks of the same type (DataFrame/Series or CSR matrix)."""
+    return sp.vstack(parts, format='csr') if sp.issparse(parts[0]) else pd.concat(parts)
+
+def as_model_input(X, model_name):
+    """Densify a CSR matrix for candidates without an efficient sparse code path."""
+    if sp.issparse(X) and model_name not in SPARSE_NATIVE_MODELS:
+        return X.toarray()
+    return X
+
+def set_model_threads(model, n_threads):
+    """Set the thread count of candidates with an `n_jobs` parameter (RandomForest, XGBoost, LightGBM)."""
+    if "n_jobs" in model.get_params():
+        model.set_params(n_jobs=n_threads)
+    return model
+
+def fit_and_score_fold(model, name, X, y, train_idx, val_idx):
+    """Fit a candidate on one CV fold and return (R2, RMSE) on the held-out rows."""
+    X_tr = as_model_input(take_rows(X, train_idx), name)
+    X_val = as_model_input(take_rows(X, val_idx), name)
+    model.fit(X_tr, take_rows(y, train_idx))
+    y_pred = model.predict(X_val)
+    y_val = take_rows(y, val_idx)
+    return r2_score(y_val, y_pred), root_mean_squared_error(y_val, y_pred)
+
+def run_fold_job(model, name, X, y, train_idx, val_idx, n_threads):
+    """Worker entry point of the parallel CV: a fresh copy of the candidate, limited to `n_threads`."""
+    try:
+        return name, fit_and_score_fold(set_model_threads(clone(model), n_threads), name, X, y, train_idx, val_idx), None
+    except Exception as e:
+        return name, None, str(e)
+
+def data_fingerprint(X, y):
+    """Content hash of a training matrix (DataFrame, array or CSR matrix) and its target."""
+    return joblib.hash((X, y))
+
+def model_fingerprint(model):
+    """Hash of a candidate's class, library version and parameters (thread counts excluded: they do not change scores)."""
+    model_class = type(model)
+    library = sys.modules[model_class.__module__.split(".")[0]]
+    params = {k: v for k, v in model.get_params().items() if k != "n_jobs"}
+    return joblib.hash((f"{model_class.__module__}.{model_class.__qualname__}", getattr(library, "__version__", None), params))
 
 # ========================== Model Selection Class ==========================
 class ModelSelectorCV:
     """Perform K-Fold cross-validation to compare different models."""
-    def __init__(self, models, X_train, y_train, X_val=None, y_val=None, X_test=None, y_test=None, n_splits=5):
+    def __init__(self, models, X_train, y_train, X_val=None, y_val=None, X_test=None, y_test=None, n_splits=5, n_jobs=1,
+                 use_cache=MODELING_CV_CACHE, cache_dir=CV_CACHE_DIR):
         self.models = models
         self.X_train = X_train
         self.y_train = y_train
@@ -35,23 +148,23 @@ class ModelSelectorCV:
         self.X_test = X_test
         self.y_test = y_test
         self.n_splits = n_splits
+        self.n_jobs = n_jobs
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.data_hash = None
         self.results = []
 
     def cross_validate_model(self, model, name):
         """Evaluate a model using K-Fold CV and return metrics."""
         logging.info(f"Cross-validating model: {name}")
-        kf = KFold(n_splits=self.n_splits, shuffle=True, random_state=42)
+        kf = KFold(n_splits=self.n_splits, shuffle=True, random_state=CV_SEED)
         r2_scores = []
         rmse_scores = []
 
         for train_idx, val_idx in kf.split(self.X_train):
-            X_tr, X_val = self.X_train.iloc[train_idx], self.X_train.iloc[val_idx]
-            y_tr, y_val = self.y_train.iloc[train_idx], self.y_train.iloc[val_idx]
-
-            model.fit(X_tr, y_tr)
-            y_pred = model.predict(X_val)
-            r2_scores.append(r2_score(y_val, y_pred))
-            rmse_scores.append(root_mean_squared_error(y_val, y_pred))
+            r2, rmse = fit_and_score_fold(model, name, self.X_train, self.y_train, train_idx, val_idx)
+            r2_scores.append(r2)
+            rmse_scores.append(rmse)
 
         return {
             "model_name": name,
@@ -60,16 +173,88 @@ class ModelSelectorCV:
             "model_object": model
         }
 
+    def cv_cache_path(self, model):
+        """Cache file of a candidate's CV result: training data hash + model fingerprint + folds."""
+        if self.data_hash is None:
+            self.data_hash = data_fingerprint(self.X_train, self.y_train)
+        key = joblib.hash((self.data_hash, model_fingerprint(model), self.n_splits, CV_SEED))
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load_cached_result(self, model, name):
+        path = self.cv_cache_path(model)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            cached = json.load(f)
+        return {"model_name": name, "mean_r2": cached["mean_r2"], "mean_rmse": cached["mean_rmse"], "model_object": model}
+
+    def add_result(self, result, model, cached=False):
+        """Record a CV result, log it and (for new results) store it in the CV cache."""
+        self.results.append(result)
+        name = result["model_name"]
+        logging.info(f"{name:15} | R2: {result['mean_r2']:.4f} | RMSE: {result['mean_rmse']:.2f}" + (" (cached)" if cached else ""))
+        if self.use_cache and not cached:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self.cv_cache_path(model)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"model_name": name, "mean_r2": float(result["mean_r2"]), "mean_rmse": float(result["mean_rmse"])}, f)
+            os.replace(path + ".tmp", path)
+
+    def run_cv_parallel(self, models):
+        """
+        Run every (model, fold) pair as a job on a process pool. Training arrays are
+        memory-mapped into the workers instead of copied, and each worker's tree/BLAS
+        threads are capped at its share of the cores. Scores match the sequential run;
+        `model_object` is the unfitted candidate (it is refit on the full training set anyway).
+        """
+        n_cores = joblib.cpu_count()
+        folds = list(KFold(n_splits=self.n_splits, shuffle=True, random_state=CV_SEED).split(self.X_train))
+        jobs = [(name, model, train_idx, val_idx) for name, model in models for train_idx, val_idx in folds]
+        n_workers = min(self.n_jobs if self.n_jobs > 0 else n_cores, len(jobs))
+        n_threads = max(1, n_cores // n_workers)
+        logging.info(f"Running {len(jobs)} (model, fold) jobs on {n_workers} worker(s) x {n_threads} thread(s)...")
+
+        with parallel_config(backend="loky", inner_max_num_threads=n_threads):
+            outputs = Parallel(n_jobs=n_workers, max_nbytes="1M", mmap_mode="r")(
+                delayed(run_fold_job)(model, name, self.X_train, self.y_train, train_idx, val_idx, n_threads)
+                for name, model, train_idx, val_idx in jobs
+            )
+
+        for name, model in models:
+            scores = [score for job_name, score, _ in outputs if job_name == name]
+            errors = [error for job_name, _, error in outputs if job_name == name and error]
+            if errors:
+                logging.error(f"Error evaluating {name}: {errors[0]}")
+                continue
+            self.add_result({
+                "model_name": name,
+                "mean_r2": np.mean([r2 for r2, _ in scores]),
+                "mean_rmse": np.mean([rmse for _, rmse in scores]),
+                "model_object": model,
+            }, model)
+
     def run_cv(self):
-        """Run CV for all models and print their average scores."""
+        """Run CV for all models (reusing cached results of unchanged data and models) and print their average scores."""
         logging.info(f"Running K-Fold CV with {self.n_splits} folds...")
+        pending = []
         for name, model in self.models:
-            try:
-                result = self.cross_validate_model(model, name)
-                self.results.append(result)
-                logging.info(f"{name:15} | R2: {result['mean_r2']:.4f} | RMSE: {result['mean_rmse']:.2f}")
-            except Exception as e:
-                logging.error(f"Error evaluating {name}: {e}")
+            cached = self.load_cached_result(model, name) if self.use_cache else None
+            if cached is not None:
+                self.add_result(cached, model, cached=True)
+            else:
+                pending.append((name, model))
+
+        if pending and self.n_jobs != 1:
+            self.run_cv_parallel(pending)
+        else:
+            for name, model in pending:
+                try:
+                    self.add_result(self.cross_validate_model(model, name), model)
+                except Exception as e:
+                    logging.error(f"Error evaluating {name}: {e}")
+
+        order = [name for name, _ in self.models]
+        self.results.sort(key=lambda result: order.index(result["model_name"]))
 
     def get_best_model(self, by="mean_r2"):
         """Return best model based on R2 or RMSE."""
@@ -88,16 +273,20 @@ def split_into_train_val_test(X, y):
     X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=0.1, random_state=42, shuffle=True)
     return X_train, X_val, X_test, y_train, y_val, y_test
 
-def modelSelction(X_train, y_train, n_split=5):
-    """Define and evaluate a list of candidate models using CV."""
-    models = [
+def get_candidate_models():
+    """Fresh (unfitted) instances of the candidate models, as (name, model) pairs."""
+    return [
         ("LinearRegression", LinearRegression()),
         ("Ridge", Ridge()),
-        ("RandomForest", RandomForestRegressor(n_estimators=100, random_state=42)),
-        ("XGBoost", XGBRegressor(n_estimators=100, random_state=42)),
+        ("RandomForest", RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1)),
+        ("XGBoost", XGBRegressor(n_estimators=100, random_state=42, n_jobs=-1)),
         ("LightGBM", LGBMRegressor(n_estimators=100, random_state=42)),
     ]
-    selector = ModelSelectorCV(models, X_train, y_train, n_splits=n_split)
+
+def modelSelction(X_train, y_train, n_split=5, n_jobs=MODELING_CV_JOBS):
+    """Define and evaluate a list of candidate models using CV."""
+    models = get_candidate_models()
+    selector = ModelSelectorCV(models, X_train, y_train, n_splits=n_split, n_jobs=n_jobs)
     selector.run_cv()
     return selector
 
@@ -129,46 +318,45 @@ def modelSelction(X_train, y_train, n_split=5):
 #     logging.info(f"Eval R²: {r2_score(y_val, y_pred_eval):.4f}")
 #     logging.info(f"Eval RMSE: {root_mean_squared_error(y_val, y_pred_eval):.2f}")
 #     return best_model
+# Hyperparameter search space of each candidate
+PARAM_GRIDS = {
+    "XGBoost": {
+        'n_estimators': [100, 200],
+        'learning_rate': [0.01, 0.1],
+        'max_depth': [3, 6],
+        'subsample': [0.7, 1.0],
+        'colsample_bytree': [0.7, 1.0]
+    },
+    "LightGBM": {
+        'n_estimators': [100, 200],
+        'learning_rate': [0.01, 0.1],
+        'max_depth': [3, 6, -1],
+        'subsample': [0.7, 1.0],
+        'colsample_bytree': [0.7, 1.0]
+    },
+    "RandomForest": {
+        'n_estimators': [100, 200],
+        'max_depth': [None, 10, 20],
+        'max_features': ['sqrt', 'log2']
+    },
+    "Ridge": {
+        'alpha': [0.1, 1.0, 10.0],
+        'fit_intercept': [True, False]
+    }
+    # LinearRegression does not need tuning
+}
 
 def model_finetuning(model, X_train, y_train, X_val, y_val, model_name=""):
     """Perform GridSearchCV tuning based on model type."""
     logging.info(f"Starting hyperparameter tuning for {model_name}...")
 
-    # Define parameter grid for each model
-    param_grids = {
-        "XGBoost": {
-            'n_estimators': [100, 200],
-            'learning_rate': [0.01, 0.1],
-            'max_depth': [3, 6],
-            'subsample': [0.7, 1.0],
-            'colsample_bytree': [0.7, 1.0]
-        },
-        "LightGBM": {
-            'n_estimators': [100, 200],
-            'learning_rate': [0.01, 0.1],
-            'max_depth': [3, 6, -1],
-            'subsample': [0.7, 1.0],
-            'colsample_bytree': [0.7, 1.0]
-        },
-        "RandomForest": {
-            'n_estimators': [100, 200],
-            'max_depth': [None, 10, 20],
-            'max_features': ['sqrt', 'log2']
-        },
-        "Ridge": {
-            'alpha': [0.1, 1.0, 10.0],
-            'fit_intercept': [True, False]
-        }
-        # LinearRegression does not need tuning
-    }
-
-    if model_name not in param_grids:
+    if model_name not in PARAM_GRIDS:
         logging.warning(f"No tuning grid defined for model '{model_name}'. Skipping GridSearch.")
         model.fit(X_train, y_train)
         return model
 
     # Perform Grid Search
-    param_grid = param_grids[model_name]
+    param_grid = PARAM_GRIDS[model_name]
     grid_search = GridSearchCV(
         estimator=model,
         param_grid=param_grid,
@@ -187,8 +375,113 @@ def model_finetuning(model, X_train, y_train, X_val, y_val, model_name=""):
     logging.info(f"Eval RMSE: {root_mean_squared_error(y_val, y_pred_eval):.2f}")
     return best_model
 
+def estimate_halving_fits(n_candidates, n_samples, factor=HALVING_FACTOR, cv=5):
+    """Approximate cost of a successive-halving search with 'exhaust' resources, in full-training-set fits."""
+    n_iterations = 1 + int(np.floor(np.log(n_candidates) / np.log(factor)))
+    min_resources = n_samples // factor ** (n_iterations - 1)
+    return sum(
+        np.ceil(n_candidates / factor ** i) * min(min_resources * factor ** i, n_samples) / n_samples * (cv - 1)
+        for i in range(n_iterations)
+    )
+
+def early_stopped_n_estimators(model, model_name, X_train, y_train, X_val, y_val):
+    """Number of boosting rounds after which the validation loss stopped improving (up to MODELING_MAX_ESTIMATORS)."""
+    model = clone(model).set_params(n_estimators=MODELING_MAX_ESTIMATORS)
+    if model_name == "XGBoost":
+        model.set_params(early_stopping_rounds=EARLY_STOPPING_ROUNDS)
+        model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+        return model.best_iteration + 1
+    model.fit(X_train, y_train, eval_set=[(X_val, y_val)], callbacks=[lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)])
+    return model.best_iteration_
+
+def halving_search(model, candidates, X, y, deadline, n_split=5, factor=HALVING_FACTOR):
+    """
+    Successive halving with 'exhaust' resources: each rung scores the remaining parameter sets by
+    K-fold CV R² on a larger subsample of (X, y) and keeps the best 1/`factor`, the last rung uses
+    all rows. No candidate is started after `deadline` (a time.perf_counter() value); the last
+    completed rung decides, ties going to the earlier candidate.
+    Returns (params, CV R²) of the winner, or None if not even the first rung completed.
+    """
+    n_samples = X.shape[0]
+    n_rungs = 1 + int(np.floor(np.log(len(candidates)) / np.log(factor)))
+    min_resources = n_samples // factor ** (n_rungs - 1)
+    order = np.random.RandomState(CV_SEED).permutation(n_samples)
+    cv = KFold(n_splits=n_split, shuffle=True, random_state=CV_SEED)
+    n_workers = min(joblib.cpu_count(), n_split)
+    estimator = set_model_threads(clone(model), 1) if n_workers > 1 else model
+
+    survivors, best = candidates, None
+    for rung in range(n_rungs):
+        n_rows = min(min_resources * factor ** rung, n_samples)
+        idx = np.sort(order[:n_rows])
+        X_rung, y_rung = take_rows(X, idx), take_rows(y, idx)
+        scores = []
+        for params in survivors:
+            if time.perf_counter() >= deadline:
+                logging.warning(f"Tuning budget reached in rung {rung + 1}/{n_rungs}; keeping the result of the last completed rung.")
+                return best
+            fold_scores = cross_val_score(clone(estimator).set_params(**params), X_rung, y_rung, scoring='r2', cv=cv, n_jobs=n_workers)
+            scores.append(float(np.mean(fold_scores)))
+        ranking = sorted(range(len(survivors)), key=lambda i: -scores[i])
+        best = (survivors[ranking[0]], scores[ranking[0]])
+        logging.info(f"Rung {rung + 1}/{n_rungs}: {len(survivors)} candidate(s) on {n_rows} rows, best CV R²: {best[1]:.4f}")
+        survivors = [survivors[i] for i in ranking[:int(np.ceil(len(survivors) / factor))]]
+    return best
+
+def model_tuning(model, X_train, y_train, X_val, y_val, model_name="", time_budget=MODELING_TUNING_BUDGET, max_trials=MODELING_TUNING_TRIALS, n_split=5):
+    """
+    Budget-aware replacement of model_finetuning: successive halving over PARAM_GRIDS, with as many
+    candidates as are expected to fit in `time_budget` seconds (estimated from one timed fit) and at
+    most `max_trials`. The untuned parameters take part as the first candidate, so the model is only
+    changed when sampled parameters score a better CV R² on the same rows and folds, and the search
+    stops at the deadline. Boosted models then get their number of rounds from early stopping on the
+    validation set. Returns the tuned (or the given), unfitted model.
+    """
+    if model_name not in PARAM_GRIDS:
+        logging.warning(f"No tuning grid defined for model '{model_name}'. Skipping tuning.")
+        return model
 
-def model_final_training_and_testing(model, scaler, X_train, y_train, X_test, y_test):
+    start = time.perf_counter()
+    deadline = start + time_budget if time_budget else np.inf
+    param_grid = PARAM_GRIDS[model_name]
+    grid_size = int(np.prod([len(values) for values in param_grid.values()]))
+    X_fit = as_model_input(X_train, model_name)
+    clone(model).fit(X_fit, y_train)
+    fit_seconds = time.perf_counter() - start
+    remaining = deadline - time.perf_counter()
+
+    n_candidates = min(grid_size, max_trials) if max_trials else grid_size
+    while n_candidates > 1 and estimate_halving_fits(n_candidates + 1, X_train.shape[0], cv=n_split) * fit_seconds > remaining:
+        n_candidates -= 1
+    if n_candidates < HALVING_FACTOR:
+        logging.warning(f"Tuning budget of {time_budget}s is too small for {model_name} (one fit takes {fit_seconds:.1f}s). Skipping tuning.")
+        return model
+    logging.info(f"Tuning {model_name}: untuned + {n_candidates}/{grid_size} candidates by successive halving (one fit: {fit_seconds:.1f}s)...")
+
+    candidates = [{}] + list(ParameterSampler(param_grid, n_candidates, random_state=42))
+    best = halving_search(model, candidates, X_fit, y_train, deadline, n_split=n_split)
+    if best is None or not best[0]:
+        logging.info(f"No sampled parameters beat the untuned {model_name}; keeping it.")
+        return model
+    best_params, best_score = best
+    best_model = clone(model).set_params(**best_params)
+    logging.info(f"Best hyperparameters for {model_name}: {best_params} (CV R²: {best_score:.4f})")
+
+    if model_name in ("XGBoost", "LightGBM"):
+        if time.perf_counter() < deadline:
+            n_estimators = early_stopped_n_estimators(
+                best_model, model_name, X_fit, y_train, as_model_input(X_val, model_name), y_val
+            )
+            best_model.set_params(n_estimators=n_estimators)
+            logging.info(f"Early stopping on validation set: {n_estimators} boosting rounds")
+        else:
+            logging.warning("Tuning budget reached; skipping early stopping.")
+
+    logging.info(f"Tuning {model_name} took {time.perf_counter() - start:.1f}s (budget: {time_budget or 'none'}s)")
+    return best_model
+
+
+def model_final_training_and_testing(model, pipeline, X_train, y_train, X_test, y_test):
     """Train final model on full train set and evaluate on test set."""
     logging.info("Final training and evaluation on test set...")
     model.fit(X_train, y_train)
@@ -200,8 +493,8 @@ def model_final_training_and_testing(model, scaler, X_train, y_train, X_test, y_
     logging.info(f"MAE: {mean_absolute_error(y_test, y_pred_test):.2f}")
 
     # Inverse transform to original scale
-    y_test_original = scaler['Total_Price'].inverse_transform(y_test.values.reshape(-1, 1))
-    y_pred_original = scaler['Total_Price'].inverse_transform(y_pred_test.reshape(-1, 1))
+    y_test_original = pipeline.inverse_transform_target(y_test)
+    y_pred_original = pipeline.inverse_transform_target(y_pred_test)
 
     logging.info("TEST RESULTS (original scale):")
     logging.info(f"R²: {r2_score(y_test_original, y_pred_original):.4f}")
@@ -212,21 +505,164 @@ def model_final_training_and_testing(model, scaler, X_train, y_train, X_test, y_
 
 # ========================== Data Loading ==========================
 def load_data():
-    """Load feature dataset and preprocessing artifacts."""
+    """Load feature dataset and the fitted feature pipeline."""
     logging.info("Loading training data and preprocessing artifacts...")
     df = pd.read_csv(os.path.join(DATA_DIR, "data_for_modeling", "data.csv"))
-    scaler = joblib.load(os.path.join(MODEL_DIR, "scalers_per_column.pkl"))
-    label_binarizer = joblib.load(os.path.join(MODEL_DIR, "multilabel_binarizer_refund_policy.pkl"))
-    return df, scaler, label_binarizer
+    pipeline = load_pipeline(MODEL_DIR)
+    return df, pipeline
+
+def load_binary_data():
+    """Memory-map the binary dataset (dense or CSR) and load the fitted feature pipeline."""
+    logging.info("Memory-mapping training data and loading preprocessing artifacts...")
+    X, y, columns = load_training_dataset(MODELING_DATA_DIR, mmap=True)
+    pipeline = load_pipeline(MODEL_DIR)
+    logging.info(f"Loaded {X.shape[0]} rows x {X.shape[1]} columns.")
+    return X, y, columns, pipeline
+
+def load_feature_store_data(sparse=False, window_days=MODELING_WINDOW_DAYS, scrape_after=None):
+    """
+    Load features and scaled target from the incremental feature store, with the fitted feature pipeline.
+    `scrape_after` keeps only the rows scraped after that time (the rows not trained on yet).
+    """
+    logging.info("Loading training data from the feature store...")
+    pipeline = load_pipeline(MODEL_DIR)
+    scrape_from = datetime.now() - timedelta(days=window_days) if window_days else None
+    if scrape_after is not None:
+        scrape_from = max(scrape_from, scrape_after) if scrape_from else scrape_after
+    columns = pipeline.feature_names_ + [TARGET_COLUMN, 'Scrape_Time']
+    if sparse:
+        # One part file at a time, so only a single file is ever held densely
+        blocks, targets = [], []
+        for part in iter_features(scrape_from, columns):
+            if scrape_after is not None:
+                part = part[part['Scrape_Time'] > scrape_after]
+            blocks.append(sp.csr_matrix(part[pipeline.feature_names_].to_numpy(dtype=np.float64)))
+            targets.append(part[TARGET_COLUMN].to_numpy(dtype=np.float64))
+        X = sp.vstack(blocks, format='csr') if blocks else sp.csr_matrix((0, len(pipeline.feature_names_)))
+        target = np.concatenate(targets) if targets else np.empty(0)
+    else:
+        df = read_features(scrape_from, columns=columns)
+        if scrape_after is not None:
+            df = df[df['Scrape_Time'] > scrape_after]
+        X, target = df[pipeline.feature_names_], df[TARGET_COLUMN]
+    y = pd.Series(pipeline.transform_target(target) if len(target) else [], name=TARGET_COLUMN, dtype=np.float64)
+    logging.info(f"Loaded {X.shape[0]} rows x {X.shape[1]} columns.")
+    return X, y, pipeline
+
+# ========================== Incremental Training ==========================
+def read_training_state():
+    """State of the last accepted training run (None before the first feature-store training)."""
+    path = os.path.join(MODEL_DIR, TRAINING_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_training_state(state, **updates):
+    state = {**(state or {}), **updates}
+    with open(os.path.join(MODEL_DIR, TRAINING_STATE_FILE), "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, default=str)
+    return state
+
+def evaluate_model(model, model_name, X_test, y_test):
+    """R2 and RMSE (scaled target) of a model on the held-out test set."""
+    y_pred = model.predict(as_model_input(X_test, model_name))
+    return {"test_r2": float(r2_score(y_test, y_pred)), "test_rmse": float(root_mean_squared_error(y_test, y_pred))}
+
+def warm_start_model(model, model_name, X, y, n_estimators=MODELING_INCREMENTAL_ESTIMATORS):
+    """Continue boosting a fitted XGBoost/LightGBM model: add `n_estimators` rounds fitted on (X, y)."""
+    updated = clone(model).set_params(n_estimators=n_estimators)
+    if model_name == "XGBoost":
+        updated.set_params(early_stopping_rounds=None)
+        return updated.fit(X, y, xgb_model=model.get_booster(), verbose=False)
+    return updated.fit(X, y, init_model=model.booster_)
+
+def full_retrain_reason(state, pipeline_hash, full_retrain_days=MODELING_FULL_RETRAIN_DAYS):
+    """Why the next run must retrain from scratch, or None if the last model can be warm-started."""
+    if state is None or not os.path.exists(os.path.join(MODEL_DIR, "final_best_model.pkl")):
+        return "no previous feature-store training"
+    if state["model_name"] not in WARM_START_MODELS:
+        return f"{state['model_name']} cannot be warm-started"
+    if state["pipeline_hash"] != pipeline_hash:
+        return "the feature pipeline was refit"
+    if datetime.now() - datetime.fromisoformat(state["last_full_train"]) > timedelta(days=full_retrain_days):
+        return f"last full retrain is older than {full_retrain_days} day(s)"
+    return None
+
+def incremental_training(state, sparse=False, tolerance=MODELING_REGRESSION_TOLERANCE):
+    """
+    Warm-start the previous model on the feature store rows scraped since its last training
+    (plus a replayed sample of its full-retrain training rows). The update replaces the saved model only if its R2 on the held-out test set of the last
+    full retrain does not drop by more than `tolerance`; otherwise the previous model is kept
+    (and the new rows are retried on the next run).
+    """
+    model_path = os.path.join(MODEL_DIR, "final_best_model.pkl")
+    model_name = state["model_name"]
+    trained_until = datetime.fromisoformat(state["trained_until"])
+    watermark = get_watermark()
+    X_new, y_new, _ = load_feature_store_data(sparse, window_days=None, scrape_after=trained_until)
+    if X_new.shape[0] == 0:
+        logging.info(f"No feature rows scraped after {trained_until}; keeping the current model.")
+        return
+
+    model = joblib.load(model_path)
+    X_test, y_test, _ = load_training_dataset(HOLDOUT_DIR, mmap=True)
+    X_replay, y_replay, _ = load_training_dataset(REPLAY_DIR, mmap=True)
+    n_replay = min(int(MODELING_REPLAY_RATIO * X_new.shape[0]), X_replay.shape[0])
+    replay_idx = np.sort(np.random.RandomState(42).choice(X_replay.shape[0], n_replay, replace=False))
+    X_update = stack_rows([X_new, take_rows(X_replay, replay_idx)])
+    y_update = stack_rows([y_new, take_rows(y_replay, replay_idx)])
+
+    start = time.perf_counter()
+    updated = warm_start_model(model, model_name, as_model_input(X_update, model_name), y_update)
+    logging.info(
+        f"Warm-started {model_name} on {X_new.shape[0]} new + {n_replay} replayed row(s) "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+    before = evaluate_model(model, model_name, X_test, y_test)
+    after = evaluate_model(updated, model_name, X_test, y_test)
+    logging.info(f"Held-out R²: {before['test_r2']:.4f} -> {after['test_r2']:.4f}")
+    if after["test_r2"] < before["test_r2"] - tolerance:
+        logging.warning(f"Incremental {model_name} regressed on the held-out test set; keeping the previous model.")
+        return
+
+    joblib.dump(updated, model_path)
+    save_training_state(state, trained_until=watermark, **after)
+    logging.info("Incrementally updated model saved successfully.")
+    # Shard models were validated against the previous global model and are not updated with it,
+    # so the updated model answers every request until the next full retrain
+    if os.path.exists(os.path.join(MODEL_DIR, SHARD_MODELS_FILE)):
+        logging.info("Dropping the shard models until the next full retrain.")
+        save_shard_models(None, MODEL_DIR)
+    register_model(
+        updated, os.path.join(MODEL_DIR, PIPELINE_FILE),
+        {"model_name": model_name, "training": "incremental", "data_fingerprint": data_fingerprint(X_update, y_update),
+         "trained_until": str(watermark), **after},
+    )
 
 # ========================== Main Pipeline ==========================
-def model_data():
+def model_data(sparse=MODELING_SPARSE, feature_store=MODELING_FEATURE_STORE, incremental=MODELING_INCREMENTAL):
     """Main function to run model selection, tuning, and evaluation."""
     logging.info("Starting model training pipeline...")
-    df, scaler, label_binarizer = load_data()
-    X = df.drop(columns=['Total_Price'])
-    y = df['Total_Price']
-    X.columns = [unidecode(c).strip("- ").strip().replace(" ", "_").replace(",", "") for c in X.columns]
+    if incremental and not feature_store:
+        logging.warning("Incremental training needs the feature store (MODELING_FEATURE_STORE=1); retraining from scratch.")
+    if feature_store:
+        state = read_training_state()
+        pipeline_hash = file_hash(os.path.join(MODEL_DIR, PIPELINE_FILE))
+        reason = full_retrain_reason(state, pipeline_hash) if incremental else "incremental training is disabled"
+        if reason is None:
+            incremental_training(state, sparse)
+            return
+        logging.info(f"Full retrain: {reason}.")
+        trained_until = get_watermark()
+        X, y, pipeline = load_feature_store_data(sparse)
+    elif sparse or MODELING_DATA_FORMAT == "npy":
+        X, y, _, pipeline = load_binary_data()
+    else:
+        df, pipeline = load_data()
+        X = df.drop(columns=[TARGET_COLUMN])
+        y = df[TARGET_COLUMN]
 
     X_train, X_val, X_test, y_train, y_val, y_test = split_into_train_val_test(X, y)
     selector = modelSelction(X_train, y_train)
@@ -236,11 +672,43 @@ def model_data():
     logging.info(f"Best model from CV: {model_name}")
 
     # best_model = model_finetuning(best_model, X_train, y_train, X_val, y_val, model_name=model_name)
-    best_model = model_final_training_and_testing(best_model, scaler, pd.concat([X_train, X_val]), pd.concat([y_train, y_val]), X_test, y_test)
+    if MODELING_TUNING:
+        best_model = model_tuning(best_model, X_train, y_train, X_val, y_val, model_name=model_name)
+    best_model = model_final_training_and_testing(
+        best_model, pipeline,
+        as_model_input(stack_rows([X_train, X_val]), model_name), stack_rows([y_train, y_val]),
+        as_model_input(X_test, model_name), y_test
+    )
 
     joblib.dump(best_model, os.path.join(MODEL_DIR, "final_best_model.pkl"))
     logging.info("Final model saved successfully.")
 
+    # Route/airline sub-models with the same hyperparameters; stale ones are removed when sharding is off
+    shard_models = None
+    if MODELING_SHARD_BY:
+        shard_models = train_shard_models(
+            best_model, best_model, pipeline.feature_names_, X_train, y_train, X_val, y_val, X_test, y_test,
+        )
+    save_shard_models(shard_models, MODEL_DIR)
+    metrics = evaluate_model(best_model, model_name, X_test, y_test)
+    register_model(
+        best_model, os.path.join(MODEL_DIR, PIPELINE_FILE),
+        {"model_name": model_name, "training": "full", "data_fingerprint": data_fingerprint(X, y), **metrics},
+        shard_models=shard_models,
+    )
+
+    if feature_store:
+        # Keep the test split, a replay sample of the training rows and the data watermark,
+        # for later warm-started updates
+        save_training_dataset(X_test, y_test, pipeline.feature_names_, HOLDOUT_DIR)
+        X_fit, y_fit = stack_rows([X_train, X_val]), stack_rows([y_train, y_val])
+        replay_idx = np.sort(np.random.RandomState(42).choice(X_fit.shape[0], min(MODELING_REPLAY_ROWS, X_fit.shape[0]), replace=False))
+        save_training_dataset(take_rows(X_fit, replay_idx), take_rows(y_fit, replay_idx), pipeline.feature_names_, REPLAY_DIR)
+        save_training_state(
+            None, model_name=model_name, pipeline_hash=pipeline_hash, trained_until=trained_until,
+            last_full_train=datetime.now().isoformat(timespec="seconds"), **metrics,
+        )
+
 if __name__ == "__main__":
     setup_logger(log_dir="logs")
     model_data()
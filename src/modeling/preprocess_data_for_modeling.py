@@ -1,15 +1,27 @@
 import pandas as pd
 import numpy as np
-import ast
 import os
-import joblib
+import shutil
 import logging
-from unidecode import unidecode
+import scipy.sparse as sp
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, bindparam, text
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-import urllib
-from sklearn.preprocessing import MultiLabelBinarizer, OneHotEncoder, StandardScaler
 from src.utils.logger_utils import setup_logger
+from src.utils.db_utils import get_engine, qualified_table, quote, read_query
+from src.utils.refund_policy import parse_refund_policies
+from src.etl.schema_migration import FLIGHT_KEY
+from src.etl.fare_change_detection import FARE_KEY
+from src.modeling.feature_pipeline import (
+    CATEGORICAL_COLUMNS, DATETIME_FEATURES, NUMERIC_COLUMNS, PIPELINE_FILE, TARGET_COLUMN,
+    FeaturePipeline, load_pipeline, normalize_column_name, save_pipeline,
+)
+from src.modeling.training_dataset import save_training_dataset_chunks
+from src.modeling.feature_store import (
+    FEATURE_KEY, FEATURE_STORE_DIR, MODELING_FEATURE_STORE,
+    count_features_by_date, get_watermark, is_store_current, replace_partitions, swap_store,
+    write_features, write_manifest,
+)
 
 # ========================== Directory Setup ==========================
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
@@ -20,41 +32,85 @@ os.makedirs(MODEL_DIR, exist_ok=True)
 
 # ========================== Load Environment Variables ==========================
 load_dotenv()
-username = os.getenv("DB_USER")
-password = os.getenv("DB_PASSWORD")
-server = os.getenv("DB_SERVER")
-database = os.getenv("DB_NAME")
+
+# MODELING_SPARSE=1 keeps the one-hot features as a CSR matrix end to end
+MODELING_SPARSE = os.getenv("MODELING_SPARSE", "0") == "1"
+MODELING_DATA_DIR = os.path.join(DATA_DIR, "data_for_modeling")
+
+# Training dataset format: "npy" (memory-mappable binary arrays + manifest) or "csv" (legacy data.csv);
+# sparse datasets are always written as npy
+MODELING_DATA_FORMAT = os.getenv("MODELING_DATA_FORMAT", "npy").lower()
+
+# Scrape-time window (days back from now) of the tickets used for modeling; unset = all stored tickets
+MODELING_WINDOW_DAYS = int(os.getenv("MODELING_WINDOW_DAYS")) if os.getenv("MODELING_WINDOW_DAYS") else None
+MODELING_CHUNK_SIZE = int(os.getenv("MODELING_CHUNK_SIZE", "50000"))
+
+# Columns read for modeling, per table (everything else stays in the database)
+MODELING_COLUMNS = {
+    "TICKET": ['Departure Time', 'Scrape Time', 'Total Price', 'Carry-on Baggage', 'Checked Baggage', 'Fare Class', 'Airline_id'],
+    "FLIGHT_SCHEDULE": ['Arrival Location Code', 'Flight Duration', 'Aircraft Type'],
+    "REFUND_POLICY": ['Refund Policy'],
+}
 
 # ========================== SQL Utilities ==========================
-def load_data_from_sql(table_name):
-    """Connect to SQL Server and read a table into a DataFrame."""
-    logging.info(f"Loading table: {table_name}")
-    params = urllib.parse.quote_plus(
-        f"DRIVER=ODBC Driver 17 for SQL Server;"
-        f"SERVER={server};"
-        f"DATABASE={database};"
-        f"UID={username};"
-        f"PWD={password};"
-        f"TrustServerCertificate=yes;"
-        f"CHARSET=UTF8;"
-    )
-    conn_str = f"mssql+pyodbc:///?odbc_connect={params}"
-    engine = create_engine(conn_str, fast_executemany=True)
-    return pd.read_sql(table_name, engine)
-
-def load_data():
-    """Load and join all required tables from the SQL database."""
-    logging.info("Joining all related tables from SQL Server...")
-    airport_df = load_data_from_sql("AIRPORT")
-    airline_df = load_data_from_sql("AIRLINE")
-    refund_policy_df = load_data_from_sql("REFUND_POLICY")
-    flight_schedule_df = load_data_from_sql("FLIGHT_SCHEDULE")
-    ticket_df = load_data_from_sql("TICKET")
-
-    df = ticket_df.merge(flight_schedule_df, on=['Departure Time', 'Flight Code', 'Departure Location Code'])
-    df = df.merge(refund_policy_df, on=['Airline_id', 'Fare Class'])
+def modeling_join(engine):
+    """FROM clause of the TICKET (t) x FLIGHT_SCHEDULE (f) x REFUND_POLICY (r) join."""
+    flight_match = " AND ".join(f"t.{quote(engine, c)} = f.{quote(engine, c)}" for c in FLIGHT_KEY)
+    policy_match = " AND ".join(f"t.{quote(engine, c)} = r.{quote(engine, c)}" for c in ['Airline_id', 'Fare Class'])
+    return f"""
+        FROM {qualified_table(engine, "TICKET")} t
+        JOIN {qualified_table(engine, "FLIGHT_SCHEDULE")} f ON {flight_match}
+        JOIN {qualified_table(engine, "REFUND_POLICY")} r ON {policy_match}
+    """
+
+def build_modeling_query(engine, scrape_from=None, with_key=False):
+    """
+    Build the TICKET x FLIGHT_SCHEDULE x REFUND_POLICY join with only the modeling
+    columns, optionally restricted to tickets scraped from `scrape_from` on.
+    `with_key` also selects the rest of the ticket natural key (for the feature store).
+    Rows are ordered by scrape time and fare key.
+    """
+    aliases = {"TICKET": "t", "FLIGHT_SCHEDULE": "f", "REFUND_POLICY": "r"}
+    columns = [(table, c) for table, table_columns in MODELING_COLUMNS.items() for c in table_columns]
+    if with_key:
+        columns += [("TICKET", c) for c in FARE_KEY if c not in MODELING_COLUMNS["TICKET"]]
+    select_cols = ", ".join(f"{aliases[table]}.{quote(engine, c)}" for table, c in columns)
+    query = f"SELECT {select_cols} {modeling_join(engine)}"
+    if scrape_from is not None:
+        query += f" WHERE t.{quote(engine, 'Scrape Time')} >= :scrape_from"
+    # Deterministic row order, so the train/test split and CV folds are reproducible
+    # (a ticket can join several schedule/policy rows, so their columns break ties)
+    order_cols = [("t", c) for c in ['Scrape Time'] + FARE_KEY]
+    order_cols += [(aliases[table], c) for table in ("FLIGHT_SCHEDULE", "REFUND_POLICY") for c in MODELING_COLUMNS[table]]
+    order_by = ", ".join(f"{alias}.{quote(engine, c)}" for alias, c in order_cols)
+    return query + f" ORDER BY {order_by}"
+
+def iter_modeling_data(scrape_from=None, chunksize=MODELING_CHUNK_SIZE, with_key=False):
+    """Run the modeling join in the database and stream the result in chunks."""
+    engine = get_engine()
+    query = text(build_modeling_query(engine, scrape_from, with_key))
+    params = None
+    if scrape_from is not None:
+        query = query.bindparams(bindparam("scrape_from", type_=DateTime()))
+        params = {"scrape_from": scrape_from}
+    return pd.read_sql(query, engine, params=params, chunksize=chunksize)
+
+def count_modeling_rows_by_date():
+    """Rows of the modeling join per scrape date, grouped in the database by scrape time."""
+    engine = get_engine()
+    scrape_time = f"t.{quote(engine, 'Scrape Time')}"
+    counts = read_query(f"SELECT {scrape_time} AS scrape_time, COUNT(*) AS n_rows {modeling_join(engine)} GROUP BY {scrape_time}", engine=engine)
+    return counts.groupby(pd.to_datetime(counts['scrape_time'], errors='coerce').dt.date)['n_rows'].sum().to_dict()
+
+def load_data(window_days=MODELING_WINDOW_DAYS, with_key=False):
+    """Load the joined modeling data (optionally only the last `window_days` of scrapes)."""
+    scrape_from = datetime.now() - timedelta(days=window_days) if window_days else None
+    window = f"scraped since {scrape_from:%Y-%m-%d}" if scrape_from else "all stored tickets"
+    logging.info(f"Joining TICKET, FLIGHT_SCHEDULE and REFUND_POLICY in the database ({window})...")
+    chunks = list(iter_modeling_data(scrape_from, with_key=with_key))
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
     logging.info(f"Loaded {len(df)} rows after join.")
-    return df, airport_df, airline_df, refund_policy_df, flight_schedule_df, ticket_df
+    return df
 
 # ========================== Data Cleaning ==========================
 def handle_missing_value(df):
@@ -65,102 +121,169 @@ def handle_missing_value(df):
 def handle_datetime(df):
     logging.info("Converting datetime columns...")
     df['Departure_Time'] = pd.to_datetime(df['Departure_Time'], errors='coerce')
-    df['Arrival_Time'] = pd.to_datetime(df['Arrival_Time'], errors='coerce')
     df['Scrape_Time'] = pd.to_datetime(df['Scrape_Time'], errors='coerce')
     return df
 
 def handle_numerical(df):
     logging.info("Dropping unnecessary numerical columns...")
-    df.drop(columns=['Number_of_Tickets', "Price_per_Ticket", "Taxes_&_Fees"], inplace=True)
+    df.drop(columns=['Number_of_Tickets', "Price_per_Ticket", "Taxes_&_Fees"], inplace=True, errors='ignore')
     return df
 
 def handle_catrgorical(df):
     logging.info("Cleaning categorical features...")
-    def handle_policy(x):
-        if pd.isna(x): return []
-        x = ast.literal_eval(x)
-        return [y.replace("- ", "") for y in x]
-    df.drop(columns=['Passenger_Type', 'Departure_Location_Code', 'Flight_Code'], inplace=True)
-    df['Refund_Policy'] = df['Refund_Policy'].apply(handle_policy)
-    return df
-
-# ========================== Feature Engineering ==========================
-def feature_engineering_datetime(df):
-    logging.info("Generating datetime-based features...")
-    df['Departure_Hour'] = df['Departure_Time'].dt.hour
-    df['Departure_DayOfWeek'] = df['Departure_Time'].dt.dayofweek
-    df['Days Before_Departure'] = (df['Departure_Time'] - df['Scrape_Time']).dt.days
-    return df
-
-def feature_engineering_numerical(df):
-    logging.info("Scaling numerical features...")
-    scalers = {}
-    num_scaled = pd.DataFrame()
-    for col in df.columns:
-        scaler = StandardScaler()
-        scaler.fit(df[[col]])
-        num_scaled[col] = scaler.transform(df[[col]])[:, 0]
-        scalers[col] = scaler
-    joblib.dump(scalers, os.path.join(MODEL_DIR, "scalers_per_column.pkl"))
-    return num_scaled
-
-def feature_engineering_categorical(df):
-    logging.info("Encoding categorical and multi-label features...")
-    encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
-    X_cat = encoder.fit_transform(df.drop(columns=['Refund_Policy']))
-    encoded_columns = encoder.get_feature_names_out(df.drop(columns=['Refund_Policy']).columns)
-    X_cat_df = pd.DataFrame(X_cat, columns=encoded_columns, index=df.index)
-    joblib.dump(encoder, os.path.join(MODEL_DIR, "onehot_encoder.pkl"))
-
-    mlb = MultiLabelBinarizer()
-    mlb.fit(df["Refund_Policy"])
-    one_hot = pd.DataFrame(mlb.transform(df['Refund_Policy']),
-                           columns=mlb.classes_, index=df.index)
-    joblib.dump(mlb, os.path.join(MODEL_DIR, "multilabel_binarizer_refund_policy.pkl"))
-
-    return pd.concat([X_cat_df, one_hot], axis=1).astype(np.uint8)
-
-def feature_engineering(df):
-    """Combine all engineered features into one DataFrame."""
-    logging.info("Combining all feature types...")
-    datetime_col_df = feature_engineering_datetime(df.select_dtypes(include='datetime').copy())
-    num_col_df = feature_engineering_numerical(df.select_dtypes(exclude=['datetime64[ns]', 'object']).copy())
-    cat_col_df = feature_engineering_categorical(df.select_dtypes(include='object').copy())
-
-    df = pd.concat([
-        num_col_df.drop(columns=['Total_Price']),
-        cat_col_df,
-        datetime_col_df.drop(columns=["Departure_Time", "Scrape_Time", "Arrival_Time"]),
-        num_col_df['Total_Price']
-    ], axis=1)
-    logging.info("Feature engineering completed.")
+    df.drop(columns=['Passenger_Type', 'Departure_Location_Code', 'Flight_Code'], inplace=True, errors='ignore')
+    df['Refund_Policy'] = parse_refund_policies(df['Refund_Policy'])
     return df
 
 # ========================== Transformation Pipeline ==========================
-def transform(df):
-    """Full preprocessing pipeline to clean, parse, and engineer features."""
-    logging.info("Starting transformation pipeline...")
+def clean(df):
+    """Handle missing values, parse datetimes and clean numerical/categorical columns."""
     df = handle_missing_value(df)
     df = handle_datetime(df)
     num_col_df = handle_numerical(df.select_dtypes(exclude=['datetime64[ns]', 'object']).copy())
     cat_col_df = handle_catrgorical(df.select_dtypes(include='object').copy())
-    df = pd.concat([num_col_df, cat_col_df, df.select_dtypes(include=['datetime64[ns]'])], axis=1)
-    return feature_engineering(df)
+    return pd.concat([num_col_df, cat_col_df, df.select_dtypes(include=['datetime64[ns]'])], axis=1)
+
+def iter_clean_chunks(scrape_from=None, with_key=False):
+    """Stream the joined data chunk by chunk with normalized column names, cleaned."""
+    for chunk in iter_modeling_data(scrape_from, with_key=with_key):
+        chunk.columns = [normalize_column_name(c) for c in chunk.columns]
+        yield clean(chunk)
+
+def transform_in_chunks(window_days=MODELING_WINDOW_DAYS, sparse=False):
+    """
+    Two streaming passes over the modeling join, so only one chunk of raw rows is in memory:
+    the first fits the feature pipeline (and counts the rows), the second transforms each chunk.
+    Returns (row count, fitted pipeline, iterator of (X, scaled target) chunks).
+    """
+    scrape_from = datetime.now() - timedelta(days=window_days) if window_days else None
+    window = f"scraped since {scrape_from:%Y-%m-%d}" if scrape_from else "all stored tickets"
+    logging.info(f"Fitting the feature pipeline on the modeling join, streamed in chunks ({window})...")
+    n_rows = 0
+    def counted(chunks):
+        nonlocal n_rows
+        for chunk in chunks:
+            n_rows += len(chunk)
+            yield chunk
+    pipeline = FeaturePipeline(sparse=sparse).fit_chunks(counted(iter_clean_chunks(scrape_from)))
+    save_pipeline(pipeline, MODEL_DIR)
+    logging.info(f"Feature pipeline fitted on {n_rows} rows: {len(pipeline.feature_names_)} columns.")
+
+    def transformed():
+        for chunk in iter_clean_chunks(scrape_from):
+            yield pipeline.transform(chunk), pipeline.transform_target(chunk[TARGET_COLUMN])
+    return n_rows, pipeline, transformed()
+
+# ========================== Feature Store ==========================
+def build_feature_rows(df, pipeline):
+    """
+    Compute feature store rows for joined tickets (normalized column names):
+    ticket key + scrape time, the pipeline's model features and the raw target.
+    """
+    keys = df[FEATURE_KEY].copy()  # clean() drops part of the key
+    for c in ['Departure_Time', 'Scrape_Time']:
+        keys[c] = pd.to_datetime(keys[c], errors='coerce')
+    df = clean(df)
+
+    unseen = sum(
+        int((~df[c].isin(categories)).sum())
+        for c, categories in zip(CATEGORICAL_COLUMNS, pipeline.onehot_encoder_.categories_)
+    )
+    if unseen:
+        logging.warning(f"{unseen} categorical value(s) unseen by the feature pipeline are encoded as zeros until the next full rebuild.")
+
+    X = pipeline.transform(df)
+    if sp.issparse(X):
+        binary = pipeline.feature_names_[len(NUMERIC_COLUMNS):-len(DATETIME_FEATURES)]
+        X = pd.DataFrame(X.toarray(), columns=pipeline.feature_names_, index=df.index).astype({c: np.uint8 for c in binary})
+    return pd.concat([keys, X, df[[TARGET_COLUMN]]], axis=1)
+
+def rebuild_feature_store(sparse=False, store_dir=None):
+    """Refit the feature pipeline on all stored tickets and rewrite the feature store from scratch."""
+    store_dir = store_dir or FEATURE_STORE_DIR
+    logging.info("Rebuilding the feature store from all stored tickets (two streaming passes)...")
+    pipeline = FeaturePipeline(sparse=sparse).fit_chunks(iter_clean_chunks(with_key=True))
+    pipeline_path = save_pipeline(pipeline, MODEL_DIR)
+
+    new_dir = store_dir + ".new"
+    shutil.rmtree(new_dir, ignore_errors=True)
+    os.makedirs(new_dir)
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    n_rows = 0
+    for i, chunk in enumerate(iter_modeling_data(with_key=True)):
+        chunk.columns = [normalize_column_name(c) for c in chunk.columns]
+        write_features(build_feature_rows(chunk, pipeline), new_dir, run_id=f"{run_id}-{i:05d}")
+        n_rows += len(chunk)
+    write_manifest(pipeline_path, pipeline.feature_names_, new_dir)
+    swap_store(new_dir, store_dir)
+    logging.info(f"Feature store rebuilt: {n_rows} rows x {len(pipeline.feature_names_)} features.")
+
+def update_feature_store(sparse=False, full=False, store_dir=None):
+    """
+    Bring the feature store in line with the stored tickets using the saved feature pipeline:
+    every scrape date whose row count differs between the modeling join and the store
+    (new scrapes, late rows with an already stored scrape time, re-ETL'd earlier days) is
+    recomputed and its partition replaced. Falls back to a full rebuild when there is no
+    usable store, the pipeline changed or the store is older than FEATURE_STORE_REFIT_DAYS.
+    """
+    store_dir = store_dir or FEATURE_STORE_DIR
+    pipeline_path = os.path.join(MODEL_DIR, PIPELINE_FILE)
+    watermark = get_watermark(store_dir)
+    if full or watermark is None or not is_store_current(pipeline_path, store_dir):
+        rebuild_feature_store(sparse, store_dir)
+        return
+    try:
+        pipeline = load_pipeline(MODEL_DIR)
+    except ValueError as e:
+        logging.info(str(e))
+        rebuild_feature_store(sparse, store_dir)
+        return
+    if pipeline.sparse != sparse:
+        rebuild_feature_store(sparse, store_dir)
+        return
+
+    db_counts, store_counts = count_modeling_rows_by_date(), count_features_by_date(store_dir)
+    stale_dates = sorted(d for d in db_counts.keys() | store_counts.keys() if db_counts.get(d, 0) != store_counts.get(d, 0))
+    if not stale_dates:
+        logging.info("Feature store is up to date.")
+        return
+
+    logging.info(f"Recomputing features for {len(stale_dates)} scrape date(s) from {stale_dates[0]} on...")
+    staged_dir = store_dir + ".update"
+    shutil.rmtree(staged_dir, ignore_errors=True)
+    run_id = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    scrape_from = datetime.combine(stale_dates[0], datetime.min.time())
+    new_rows = 0
+    for i, chunk in enumerate(iter_modeling_data(scrape_from=scrape_from, with_key=True)):
+        chunk.columns = [normalize_column_name(c) for c in chunk.columns]
+        chunk = chunk[pd.to_datetime(chunk['Scrape_Time'], errors='coerce').dt.date.isin(stale_dates)].copy()
+        if chunk.empty:
+            continue
+        write_features(build_feature_rows(chunk, pipeline), staged_dir, run_id=f"{run_id}-{i:05d}")
+        new_rows += len(chunk)
+    replace_partitions(staged_dir, stale_dates, store_dir)
+    logging.info(f"Feature store updated: {len(stale_dates)} scrape date(s) rewritten with {new_rows} row(s).")
 
 # ========================== Main Entry Point ==========================
-def preprocess_for_modeling():
-    """Main function to extract and preprocess data, saving the result to CSV."""
+def preprocess_for_modeling(sparse=MODELING_SPARSE, feature_store=MODELING_FEATURE_STORE):
+    """
+    Main function to extract and preprocess data, saving the result as a binary dataset (or CSV).
+    With `feature_store`, only new tickets are processed into the incremental feature store instead.
+    """
     logging.info("Starting preprocessing for model training...")
-    df, *_ = load_data()
-    
-    logging.info("Normalizing column names...")
-    df.columns = [unidecode(c).strip("- ").strip().replace(" ", "_").replace(",", "") for c in df.columns]
-    
-    df = transform(df)
+    if feature_store:
+        update_feature_store(sparse=sparse)
+        return
+
+    n_rows, pipeline, chunks = transform_in_chunks(sparse=sparse)
+    if sparse or MODELING_DATA_FORMAT == "npy":
+        save_training_dataset_chunks(chunks, n_rows, pipeline.feature_names_, MODELING_DATA_DIR)
+        return
 
     os.makedirs(os.path.join(DATA_DIR, "data_for_modeling"), exist_ok=True)
     output_path = os.path.join(DATA_DIR, "data_for_modeling", "data.csv")
-    df.to_csv(output_path, index=False)
+    for i, (X, y) in enumerate(chunks):
+        X.assign(**{TARGET_COLUMN: y}).to_csv(output_path, index=False, mode="w" if i == 0 else "a", header=i == 0)
     logging.info(f"Final dataset saved to: {output_path}")
 
 if __name__ == "__main__":
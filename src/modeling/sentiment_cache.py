@@ -0,0 +1,86 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+from sqlalchemy.types import NVARCHAR
+from dotenv import load_dotenv
+from src.utils.db_utils import get_engine, qualified_table, quote, table_exists, write_table
+from src.etl.schema_migration import create_index
+
+# ====================== Load environment variables ======================
+load_dotenv()
+
+# Reuse stored sentiment labels across runs (set SENTIMENT_CACHE=0 to re-score everything)
+SENTIMENT_CACHE = os.getenv("SENTIMENT_CACHE", "1") == "1"
+SENTIMENT_CACHE_TABLE = "SENTIMENT_CACHE"
+
+# Hashes looked up per query (SQL Server allows at most 2100 parameters per statement)
+CACHE_LOOKUP_BATCH = 1000
+
+CACHE_DTYPE = {
+    'model_id': NVARCHAR(200),
+    'Sentiment': NVARCHAR(20),
+}
+
+
+def normalize_text(texts):
+    """Lowercase, collapse whitespace and strip a Series of texts (missing texts become '')."""
+    return (
+        texts.fillna('').astype(str)
+        .str.lower()
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+
+
+def compute_text_hash(texts):
+    """Hash the normalized texts into signed 64-bit integers (fits BIGINT)."""
+    return pd.util.hash_pandas_object(normalize_text(texts), index=False).values.view(np.int64)
+
+
+def get_model_id(model_name, revision=None, runtime="fp32"):
+    """
+    Identify the model that produced a label: name, the Hub revision it was loaded
+    from (SENTIMENT_MODEL_VERSION overrides it, e.g. for local checkpoints) and the
+    runtime for the quantized / ONNX variants.
+    """
+    version = os.getenv("SENTIMENT_MODEL_VERSION") or revision or "main"
+    model_id = f"{model_name}@{version}"
+    return model_id if runtime == "fp32" else f"{model_id}+{runtime}"
+
+
+def load_cached_sentiments(model_id, text_hashes, engine=None):
+    """Return the cached labels of the given text hashes for a model, as a Series indexed by text hash."""
+    engine = engine or get_engine()
+    if not table_exists(SENTIMENT_CACHE_TABLE, engine):
+        return pd.Series(dtype=object)
+
+    query = text(f"""
+        SELECT {quote(engine, 'text_hash')}, {quote(engine, 'Sentiment')}
+        FROM {qualified_table(engine, SENTIMENT_CACHE_TABLE)}
+        WHERE {quote(engine, 'model_id')} = :model_id
+            AND {quote(engine, 'text_hash')} IN :text_hashes
+    """).bindparams(bindparam("text_hashes", expanding=True))
+
+    unique_hashes = pd.unique(np.asarray(text_hashes)).tolist()
+    chunks = [
+        pd.read_sql(query, engine, params={"model_id": model_id, "text_hashes": unique_hashes[i:i + CACHE_LOOKUP_BATCH]})
+        for i in range(0, len(unique_hashes), CACHE_LOOKUP_BATCH)
+    ]
+    if not chunks:
+        return pd.Series(dtype=object)
+    cached_df = pd.concat(chunks, ignore_index=True).drop_duplicates(subset='text_hash', keep='last')
+    return cached_df.set_index('text_hash')['Sentiment']
+
+
+def save_cached_sentiments(text_hashes, labels, model_id, engine=None):
+    """Append newly scored labels to the cache table."""
+    if len(text_hashes) == 0:
+        return
+    cache_df = pd.DataFrame({'text_hash': text_hashes, 'model_id': model_id, 'Sentiment': labels})
+    engine = engine or get_engine()
+    write_table(cache_df, SENTIMENT_CACHE_TABLE, 'append', dtype=CACHE_DTYPE, engine=engine)
+    with engine.begin() as conn:
+        create_index(conn, engine, "IX_SENTIMENT_CACHE_TextHash", SENTIMENT_CACHE_TABLE, ['model_id', 'text_hash'])
+    logging.info(f"Cached {len(cache_df)} new sentiment label(s) for {model_id}")
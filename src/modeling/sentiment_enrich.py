@@ -1,31 +1,63 @@
 import pandas as pd
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 import numpy as np
 from src.utils.logger_utils import setup_logger
 from dotenv import load_dotenv
 import os
-from sqlalchemy import create_engine 
+import argparse
+import multiprocessing
+from functools import partial
+from contextlib import nullcontext
+from sqlalchemy import bindparam, text
+from src.utils.db_utils import (
+    get_columns,
+    get_engine,
+    is_embedded,
+    qualified_table,
+    quote,
+    read_query,
+    read_table,
+    write_table,
+)
+from src.modeling.sentiment_cache import (
+    SENTIMENT_CACHE,
+    compute_text_hash,
+    load_cached_sentiments,
+    save_cached_sentiments,
+)
+from src.modeling.sentiment_runtime import SENTIMENT_RUNTIME, get_runtime_model_id, load_sentiment_model
 import logging
 load_dotenv()
 
-def read_data_from_db(table_name, driver, server, database, username, password):
+# Number of reviews scored per forward pass (reviews are grouped by token length)
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+
+# Parallel mode: SENTIMENT_WORKERS > 1 shards reviews across worker processes, each
+# pinned to SENTIMENT_THREADS_PER_WORKER torch threads (default: cores / workers)
+SENTIMENT_WORKERS = int(os.getenv("SENTIMENT_WORKERS", "1"))
+SENTIMENT_THREADS_PER_WORKER = int(os.getenv("SENTIMENT_THREADS_PER_WORKER", "0"))
+SENTIMENT_SHARD_SIZE = int(os.getenv("SENTIMENT_SHARD_SIZE", "256"))
+
+# Reviews read, scored and written back per chunk by the streaming pipeline
+# (SQL Server allows at most 2100 parameters per statement, so keep it below that)
+SENTIMENT_CHUNK_SIZE = int(os.getenv("SENTIMENT_CHUNK_SIZE", "1000"))
+REVIEW_TABLE = "AIRLINE_REVIEW"
+
+# Model loaded once per worker process by _init_sentiment_worker
+_worker_model = {}
+
+def read_data_from_db(table_name):
     """
-    Connect to SQL Server and read a table into a pandas DataFrame.
+    Read a table from the configured database into a pandas DataFrame.
     """
-    conn_str = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+{driver}+for+SQL+Server"
-    engine = create_engine(conn_str)
-    logging.info(f"Reading data from table: {table_name}")
-    return pd.read_sql(table_name, con=engine)
+    return read_table(table_name)
 
-def insert_into_sql_server(df, driver, server, database, username, password, mode, table_name):
+def insert_into_db(df, mode, table_name):
     """
-    Insert DataFrame into SQL Server table with specified mode (e.g., 'replace', 'append').
+    Insert DataFrame into the configured database with specified mode (e.g., 'replace', 'append').
     """
-    conn_str = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+{driver}+for+SQL+Server"
-    engine = create_engine(conn_str)
     logging.info(f"Inserting data into table: {table_name} with mode: {mode}")
-    df.to_sql(name=table_name, con=engine, schema='dbo', if_exists=mode, index=False)
+    write_table(df, table_name, mode)
     logging.info(f"Successfully inserted {len(df)} rows into {table_name}")
 
 def predict_sentiment_review(text, tokenizer, model):
@@ -40,7 +72,12 @@ def predict_sentiment_review(text, tokenizer, model):
         outputs = model(**inputs)
     probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
     predicted_class = torch.argmax(probs).item()
+    return class_to_sentiment(predicted_class)
 
+def class_to_sentiment(predicted_class):
+    """
+    Map the model's 1-5 star class index (0-4) to 'Negative', 'Neutral' or 'Positive'.
+    """
     if predicted_class <= 2:
         return "Negative"
     elif predicted_class == 3:
@@ -48,44 +85,213 @@ def predict_sentiment_review(text, tokenizer, model):
     else:
         return "Positive"
 
-def add_sentiment_column(df, tokenizer, model):
+def predict_sentiment_batch(texts, tokenizer, model, batch_size=SENTIMENT_BATCH_SIZE):
+    """
+    Predict sentiment labels for a list of texts in batches.
+    Texts are sorted by token length so each batch is only padded to its own longest
+    text (dynamic padding); labels are returned in the original order.
+    """
+    texts = [text if isinstance(text, str) else '' for text in texts]
+    if not texts:
+        return []
+
+    # Tokenize once without padding to get the length of every text
+    encodings = tokenizer(texts, truncation=True)
+    lengths = [len(ids) for ids in encodings['input_ids']]
+    order = np.argsort(lengths, kind='stable')
+
+    labels = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        batch_idx = order[start:start + batch_size]
+        features = {key: [values[i] for i in batch_idx] for key, values in encodings.items()}
+        inputs = tokenizer.pad(features, padding=True, return_tensors="pt")
+        with torch.no_grad():
+            logits = model(**inputs).logits
+        for i, predicted_class in zip(batch_idx, logits.argmax(dim=-1).tolist()):
+            labels[i] = class_to_sentiment(predicted_class)
+    return labels
+
+def _init_sentiment_worker(runtime, num_threads):
+    """Pin the worker's intra-op threads, then load the model once for all its shards."""
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    torch.set_num_threads(num_threads)
+    tokenizer, model, _ = load_sentiment_model(runtime, num_threads=num_threads)
+    _worker_model.update(tokenizer=tokenizer, model=model)
+
+def _score_shard(shard):
+    start, texts, batch_size = shard
+    return start, predict_sentiment_batch(texts, _worker_model['tokenizer'], _worker_model['model'], batch_size)
+
+def open_sentiment_pool(runtime=SENTIMENT_RUNTIME, workers=SENTIMENT_WORKERS,
+                        threads_per_worker=SENTIMENT_THREADS_PER_WORKER):
+    """
+    Start the scoring worker processes; each loads the model once and keeps it for every
+    shard it is given, so open the pool once and reuse it across chunks.
+    Use as a context manager (`with open_sentiment_pool() as pool:`).
+    """
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    logging.info(f"Starting {workers} sentiment worker(s) x {threads_per_worker} threads ({runtime})")
+    # spawn: forked workers would inherit the parent's torch thread pools
+    context = multiprocessing.get_context("spawn")
+    return context.Pool(workers, initializer=_init_sentiment_worker, initargs=(runtime, threads_per_worker))
+
+def predict_sentiment_parallel(texts, pool=None, runtime=SENTIMENT_RUNTIME, workers=SENTIMENT_WORKERS,
+                               threads_per_worker=SENTIMENT_THREADS_PER_WORKER,
+                               batch_size=SENTIMENT_BATCH_SIZE, shard_size=SENTIMENT_SHARD_SIZE):
+    """
+    Predict sentiment labels for a list of texts with a pool of worker processes.
+    Texts are split into shards of `shard_size`; each worker loads the model once and
+    uses `threads_per_worker` torch threads so the workers do not oversubscribe cores.
+    Shards go to `pool` (see open_sentiment_pool) when given, otherwise to a pool
+    started for this call. Results stream back as they finish and are returned in the original order.
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    if pool is None:
+        shards = -(-len(texts) // shard_size)
+        with open_sentiment_pool(runtime, min(workers, shards), threads_per_worker) as pool:
+            return predict_sentiment_parallel(texts, pool, batch_size=batch_size, shard_size=shard_size)
+
+    shards = [(start, texts[start:start + shard_size], batch_size) for start in range(0, len(texts), shard_size)]
+    logging.info(f"Scoring {len(texts)} reviews in {len(shards)} shards")
+    labels = [None] * len(texts)
+    for done, (start, shard_labels) in enumerate(pool.imap_unordered(_score_shard, shards), 1):
+        labels[start:start + len(shard_labels)] = shard_labels
+        logging.info(f"Scored shard {done}/{len(shards)}")
+    return labels
+
+def score_texts(texts, predict, model_id=None):
+    """
+    Return the sentiment label of every text in a Series, using `predict`
+    (list of texts -> list of labels) for the texts that need the model.
+    Identical (normalized) texts are scored once; when `model_id` is given, labels
+    already in the sentiment cache are reused and only cache misses go to the model.
+    """
+    text_hashes = pd.Series(compute_text_hash(texts), index=texts.index)
+    cached = load_cached_sentiments(model_id, text_hashes.values) if model_id else pd.Series(dtype=object)
+
+    # One representative text per distinct hash that is not cached yet
+    first_texts = texts[~text_hashes.duplicated()]
+    miss_mask = ~text_hashes[first_texts.index].isin(cached.index)
+    miss_texts = first_texts[miss_mask.values]
+    miss_hashes = text_hashes[miss_texts.index].values
+    logging.info(
+        f"Sentiment cache: {len(first_texts)} distinct texts out of {len(texts)}, "
+        f"{len(first_texts) - len(miss_texts)} cached, {len(miss_texts)} to score"
+    )
+
+    new_labels = predict(miss_texts.tolist())
+    if model_id:
+        save_cached_sentiments(miss_hashes, new_labels, model_id)
+
+    new_labels = pd.Series(new_labels, index=miss_hashes, dtype=object)
+    labels = pd.concat([cached, new_labels]) if not cached.empty else new_labels
+    return text_hashes.map(labels)
+
+def add_sentiment_column(df, tokenizer=None, model=None, batch_size=SENTIMENT_BATCH_SIZE, model_id=None, predict=None):
     """
     Add a new 'Sentiment' column to DataFrame based on Title + Review text.
+    Texts are scored in-process with `tokenizer`/`model`, or with `predict` when given
+    (e.g. predict_sentiment_parallel).
     """
-    logging.info("Generating sentiment predictions...")
+    logging.info(f"Generating sentiment predictions for {len(df)} reviews (batch size {batch_size})...")
+    predict = predict or partial(predict_sentiment_batch, tokenizer=tokenizer, model=model, batch_size=batch_size)
     df['All Text'] = "Title: " + df['Title'] + ", Review: " + df['Full Review']
-    df['Sentiment'] = df['All Text'].apply(lambda x: predict_sentiment_review(x, tokenizer, model))
+    df['Sentiment'] = score_texts(df['All Text'], predict, model_id)
     logging.info("Sentiment column added.")
     return df
 
-def main():
-    logging.info("Starting sentiment enrichment pipeline...")
+def add_sentiment_column_to_table(engine, table_name):
+    """Add a nullable 'Sentiment' column to the review table if it does not exist yet."""
+    if 'Sentiment' in get_columns(table_name, engine):
+        return
+    add_keyword, col_type = ("ADD COLUMN", "VARCHAR") if is_embedded(engine) else ("ADD", "NVARCHAR(20)")
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {qualified_table(engine, table_name)} {add_keyword} {quote(engine, 'Sentiment')} {col_type} NULL"))
+    logging.info(f"Added column 'Sentiment' to {table_name}")
 
-    model_name = "nlptown/bert-base-multilingual-uncased-sentiment"
-    logging.info(f"Loading model: {model_name}")
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+def get_review_keys_to_score(engine, table_name, rescore=False):
+    """Return the distinct review keys without a sentiment label (all keys when `rescore`)."""
+    query = f"SELECT DISTINCT {quote(engine, 'review_key')} FROM {qualified_table(engine, table_name)}"
+    if not rescore:
+        query += f" WHERE {quote(engine, 'Sentiment')} IS NULL"
+    return read_query(query, engine=engine)['review_key'].tolist()
 
-    # Load DB credentials
-    server = os.getenv("DB_SERVER")
-    database = os.getenv("DB_NAME")
-    username = os.getenv("DB_USER")
-    password = os.getenv("DB_PASSWORD")
-    driver = 17
-    table_name = "AIRLINE_REVIEW"
+def read_reviews_by_key(engine, table_name, review_keys):
+    """Read the key and text columns of the given reviews."""
+    columns = ", ".join(quote(engine, c) for c in ['review_key', 'Title', 'Full Review'])
+    query = text(f"""
+        SELECT {columns} FROM {qualified_table(engine, table_name)}
+        WHERE {quote(engine, 'review_key')} IN :review_keys
+    """).bindparams(bindparam("review_keys", expanding=True))
+    return pd.read_sql(query, engine, params={"review_keys": review_keys})
 
-    # Read data
-    df = read_data_from_db(table_name, driver, server, database, username, password)
+def update_sentiments(engine, table_name, sentiment_df):
+    """Write the labels of one chunk back to the review table, keyed by review_key."""
+    query = text(f"""
+        UPDATE {qualified_table(engine, table_name)}
+        SET {quote(engine, 'Sentiment')} = :sentiment
+        WHERE {quote(engine, 'review_key')} = :review_key
+    """)
+    params = [
+        {"sentiment": sentiment, "review_key": int(review_key)}
+        for review_key, sentiment in sentiment_df[['review_key', 'Sentiment']].itertuples(index=False, name=None)
+    ]
+    with engine.begin() as conn:
+        conn.execute(query, params)
 
-    # Enrich data with sentiment
-    enriched_df = add_sentiment_column(df, tokenizer, model)
+def enrich_in_chunks(tokenizer=None, model=None, model_id=None, predict=None,
+                     table_name=REVIEW_TABLE, chunk_size=SENTIMENT_CHUNK_SIZE, rescore=False):
+    """
+    Streaming enrichment: score the reviews of `table_name` chunk by chunk and update
+    their 'Sentiment' in place, keyed by review_key. Only unlabeled reviews are scored
+    unless `rescore`. Each chunk is committed on its own, so memory stays bounded and
+    the table stays readable throughout.
+    """
+    engine = get_engine()
+    add_sentiment_column_to_table(engine, table_name)
+    review_keys = get_review_keys_to_score(engine, table_name, rescore)
+    logging.info(f"{len(review_keys)} review(s) to score in chunks of {chunk_size}")
+
+    for start in range(0, len(review_keys), chunk_size):
+        chunk_df = read_reviews_by_key(engine, table_name, review_keys[start:start + chunk_size])
+        chunk_df = add_sentiment_column(chunk_df, tokenizer, model, model_id=model_id, predict=predict)
+        update_sentiments(engine, table_name, chunk_df.drop_duplicates(subset='review_key'))
+        logging.info(f"Updated sentiment of {min(start + chunk_size, len(review_keys))}/{len(review_keys)} review(s)")
+
+def enrich_full_table(tokenizer=None, model=None, model_id=None, predict=None, table_name=REVIEW_TABLE):
+    """Score the whole review table in memory and replace it (tables loaded without review_key)."""
+    df = read_data_from_db(table_name)
+    enriched_df = add_sentiment_column(df, tokenizer, model, model_id=model_id, predict=predict)
     enriched_df.drop(['All Text'], axis=1, inplace=True)
+    insert_into_db(enriched_df, 'replace', table_name)
+
+def main(rescore=False):
+    logging.info("Starting sentiment enrichment pipeline...")
+
+    if SENTIMENT_WORKERS > 1:
+        # Workers load their own model once for all chunks; the parent only needs the cache identity
+        tokenizer = model = None
+        model_id = get_runtime_model_id(SENTIMENT_RUNTIME)
+        pool = open_sentiment_pool(SENTIMENT_RUNTIME, SENTIMENT_WORKERS)
+        predict = partial(predict_sentiment_parallel, pool=pool)
+    else:
+        tokenizer, model, model_id = load_sentiment_model(SENTIMENT_RUNTIME)
+        pool, predict = nullcontext(), None
+    model_id = model_id if SENTIMENT_CACHE else None
 
-    # Insert back into DB
-    mode = 'replace'
-    insert_into_sql_server(enriched_df, driver, server, database, username, password, mode, table_name)
+    with pool:
+        if 'review_key' in get_columns(REVIEW_TABLE):
+            enrich_in_chunks(tokenizer, model, model_id, predict, rescore=rescore)
+        else:
+            logging.warning(f"{REVIEW_TABLE} has no review_key column, falling back to a full table replace")
+            enrich_full_table(tokenizer, model, model_id, predict)
 
     logging.info("Pipeline completed successfully.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Add sentiment labels to the airline reviews")
+    parser.add_argument("--rescore", action="store_true", help="Score every review, not only unlabeled ones")
+    args = parser.parse_args()
+    main(rescore=args.rescore)
@@ -0,0 +1,178 @@
+import os
+import json
+import types
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+import torch
+from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
+from dotenv import load_dotenv
+from src.utils.logger_utils import setup_logger
+from src.modeling.sentiment_cache import get_model_id
+
+# ====================== Load environment variables ======================
+load_dotenv()
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+
+SENTIMENT_MODEL_NAME = "nlptown/bert-base-multilingual-uncased-sentiment"
+
+# SENTIMENT_RUNTIME selects how the sentiment model is served:
+#   - "fp32": the full-precision PyTorch model from the Hub (default)
+#   - "int8": dynamically quantized PyTorch model (Linear layers in int8)
+#   - "onnx": ONNX graph served by onnxruntime (requires onnx and onnxruntime)
+# "int8" and "onnx" must be exported once with `python -m src.modeling.sentiment_runtime --export <runtime>`
+SENTIMENT_RUNTIME = os.getenv("SENTIMENT_RUNTIME", "fp32").lower()
+SENTIMENT_RUNTIMES = ("fp32", "int8", "onnx")
+SENTIMENT_EXPORT_DIR = os.getenv("SENTIMENT_EXPORT_DIR", os.path.join(BASE_DIR, "models", "sentiment"))
+
+EXPORT_INFO_FILE = "export_info.json"
+INT8_WEIGHTS_FILE = "model_int8.pt"
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_OPSET = 14
+
+
+def get_export_dir(runtime):
+    return os.path.join(SENTIMENT_EXPORT_DIR, runtime)
+
+
+def quantize_model(model):
+    """Dynamically quantize the Linear layers of a PyTorch model to int8."""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+# ====================== Export ======================
+def export_sentiment_model(runtime, model_name=SENTIMENT_MODEL_NAME):
+    """
+    One-time conversion of the Hub model into an int8 or ONNX artifact.
+    The tokenizer, config and the model revision are saved next to it so the
+    runtime works offline and the sentiment cache can tell the variants apart.
+    """
+    if runtime not in ("int8", "onnx"):
+        raise ValueError(f"Unsupported export runtime '{runtime}'. Choose 'int8' or 'onnx'.")
+
+    output_dir = get_export_dir(runtime)
+    os.makedirs(output_dir, exist_ok=True)
+    logging.info(f"Exporting {model_name} as {runtime} to {output_dir}")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+    revision = getattr(model.config, "_commit_hash", None)
+
+    if runtime == "int8":
+        torch.save(quantize_model(model).state_dict(), os.path.join(output_dir, INT8_WEIGHTS_FILE))
+    else:
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        input_names = list(sample.keys())
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["logits"] = {0: "batch"}
+        torch.onnx.export(
+            model,
+            (dict(sample),),
+            os.path.join(output_dir, ONNX_MODEL_FILE),
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+        )
+
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, EXPORT_INFO_FILE), "w") as f:
+        json.dump({"model_name": model_name, "revision": revision, "runtime": runtime}, f, indent=2)
+    logging.info(f"Export completed: {output_dir}")
+    return output_dir
+
+# ====================== Runtime ======================
+class OnnxSentimentModel:
+    """
+    Serve an exported ONNX graph with the same call signature as the PyTorch
+    model: `model(**inputs).logits`, so batching code works unchanged.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+
+        self.model_path = model_path
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def __call__(self, **inputs):
+        feed = {
+            name: value.numpy().astype(np.int64)
+            for name, value in inputs.items() if name in self.input_names
+        }
+        logits = self.session.run(["logits"], feed)[0]
+        return types.SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def read_export_info(runtime):
+    """Read the metadata of an exported runtime (model name, revision)."""
+    info_path = os.path.join(get_export_dir(runtime), EXPORT_INFO_FILE)
+    if not os.path.exists(info_path):
+        raise FileNotFoundError(
+            f"No {runtime} export found in {get_export_dir(runtime)}. "
+            f"Run: python -m src.modeling.sentiment_runtime --export {runtime}"
+        )
+    with open(info_path) as f:
+        return json.load(f)
+
+
+def get_runtime_model_id(runtime=SENTIMENT_RUNTIME, model_name=SENTIMENT_MODEL_NAME):
+    """Return the sentiment cache model_id of a runtime without loading the model weights."""
+    if runtime == "fp32":
+        config = AutoConfig.from_pretrained(model_name)
+        return get_model_id(model_name, getattr(config, "_commit_hash", None))
+    info = read_export_info(runtime)
+    return get_model_id(info["model_name"], info["revision"], runtime)
+
+
+def load_sentiment_model(runtime=SENTIMENT_RUNTIME, model_name=SENTIMENT_MODEL_NAME, num_threads=None):
+    """
+    Load the tokenizer and model for a runtime.
+    Returns (tokenizer, model, model_id) where model_id identifies the labels in the sentiment cache.
+    `num_threads` sets the ONNX Runtime intra-op threads (PyTorch uses torch.set_num_threads).
+    """
+    if runtime not in SENTIMENT_RUNTIMES:
+        raise ValueError(f"Unsupported SENTIMENT_RUNTIME '{runtime}'. Choose one of {SENTIMENT_RUNTIMES}.")
+    logging.info(f"Loading sentiment model {model_name} ({runtime})")
+
+    if runtime == "fp32":
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+        return tokenizer, model, get_model_id(model_name, getattr(model.config, "_commit_hash", None))
+
+    info = read_export_info(runtime)
+    export_dir = get_export_dir(runtime)
+    tokenizer = AutoTokenizer.from_pretrained(export_dir)
+    if runtime == "int8":
+        config = AutoConfig.from_pretrained(export_dir)
+        model = quantize_model(AutoModelForSequenceClassification.from_config(config))
+        model.load_state_dict(torch.load(os.path.join(export_dir, INT8_WEIGHTS_FILE), weights_only=False))
+        model.eval()
+    else:
+        model = OnnxSentimentModel(os.path.join(export_dir, ONNX_MODEL_FILE), num_threads=num_threads)
+    return tokenizer, model, get_model_id(info["model_name"], info["revision"], runtime)
+
+# ====================== Agreement check ======================
+def check_agreement(reference_labels, labels):
+    """
+    Compare labels of an optimized runtime with the fp32 reference labels.
+    Returns the agreement rate and a reference x candidate confusion table.
+    """
+    reference = pd.Series(list(reference_labels), name="fp32")
+    candidate = pd.Series(list(labels), name="candidate")
+    agreement = float((reference == candidate).mean()) if len(reference) else 1.0
+    return agreement, pd.crosstab(reference, candidate)
+
+
+if __name__ == "__main__":
+    setup_logger(log_dir="logs")
+    parser = argparse.ArgumentParser(description="Export the sentiment model for CPU inference")
+    parser.add_argument("--export", choices=["int8", "onnx"], required=True, help="Artifact to export")
+    args = parser.parse_args()
+    export_sentiment_model(args.export)
@@ -0,0 +1,189 @@
+import os
+import joblib
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from dotenv import load_dotenv
+from joblib import Parallel, delayed, parallel_config
+from sklearn.base import clone
+from sklearn.metrics import r2_score
+from src.modeling.feature_pipeline import normalize_column_name
+
+# ========================== Load Environment Variables ==========================
+load_dotenv()
+
+# MODELING_SHARD_BY=route|airline trains one sub-model per arrival airport (every crawled route
+# departs from SGN, and the departure airport is not a model feature) or per airline, next to
+# the global model. Shards run in MODELING_SHARD_JOBS worker processes (0 = one per core).
+# A shard is kept only if it has MODELING_SHARD_MIN_ROWS training rows and beats the global
+# model on its own validation rows; every other request is answered by the global model.
+MODELING_SHARD_BY = os.getenv("MODELING_SHARD_BY", "").lower()
+MODELING_SHARD_JOBS = int(os.getenv("MODELING_SHARD_JOBS", "0"))
+MODELING_SHARD_MIN_ROWS = int(os.getenv("MODELING_SHARD_MIN_ROWS", "500"))
+SHARD_COLUMNS = {"route": "Arrival_Location_Code", "airline": "Airline_id"}
+SHARD_MODELS_FILE = "shard_models.pkl"
+
+
+def shard_feature(shard_column, value):
+    """Name of the one-hot feature that marks the rows of a shard (as in FeaturePipeline.feature_names_)."""
+    return normalize_column_name(f"{shard_column}_{value}")
+
+
+def select(X, rows=None, columns=None):
+    """Sub-matrix by row and column positions of a DataFrame, an array or a CSR matrix."""
+    if hasattr(X, "iloc"):
+        return X.iloc[slice(None) if rows is None else rows, slice(None) if columns is None else columns]
+    if rows is not None:
+        X = X[rows]
+    return X if columns is None else X[:, columns]
+
+
+def column_values(X, j):
+    """Dense values of column `j`."""
+    if sp.issparse(X):
+        return X[:, j].toarray().ravel()
+    return np.asarray(select(X, columns=[j])).ravel()
+
+
+def stack(parts):
+    """Concatenate row blocks of the same type (DataFrame, array or CSR matrix)."""
+    if sp.issparse(parts[0]):
+        return sp.vstack(parts, format="csr")
+    return pd.concat(parts) if hasattr(parts[0], "iloc") else np.concatenate(parts)
+
+
+def densify(X, model):
+    """RandomForest gets a dense copy of CSR input (as in model selection)."""
+    return X.toarray() if sp.issparse(X) and model.__class__.__name__ == "RandomForestRegressor" else X
+
+# ========================== Training ==========================
+def fit_shard(model, X_train, y_train, X_eval, y_eval, n_threads):
+    """Fit one shard model and return it with its R2 on (X_eval, y_eval) (runs in a worker process)."""
+    if "n_jobs" in model.get_params():
+        model.set_params(n_jobs=n_threads)
+    model.fit(densify(X_train, model), y_train)
+    return model, float(r2_score(y_eval, model.predict(densify(X_eval, model))))
+
+
+def fit_shards_parallel(model, jobs, n_jobs, label):
+    """Run fit_shard for (X_train, y_train, X_eval, y_eval) jobs on a process pool."""
+    n_cores = joblib.cpu_count()
+    n_workers = min(n_jobs if n_jobs > 0 else n_cores, len(jobs))
+    n_threads = max(1, n_cores // n_workers)
+    logging.info(f"{label} {len(jobs)} shard model(s) on {n_workers} worker(s) x {n_threads} thread(s)...")
+    with parallel_config(backend="loky", inner_max_num_threads=n_threads):
+        return Parallel(n_jobs=n_workers, max_nbytes="1M", mmap_mode="r")(
+            delayed(fit_shard)(clone(model), *job, n_threads) for job in jobs
+        )
+
+
+def train_shard_models(model, global_model, feature_names, X_train, y_train, X_val, y_val, X_test, y_test,
+                       shard_by=MODELING_SHARD_BY, n_jobs=MODELING_SHARD_JOBS, min_rows=MODELING_SHARD_MIN_ROWS):
+    """
+    Train a copy of `model` (same class and hyperparameters as the global model) for every
+    route/airline shard with enough rows, in parallel. Each shard model drops the features
+    that are constant within its rows (its own one-hot group among them).
+    A shard is kept when, fitted on its training rows, it scores at least the R2 of the global
+    model fitted on the training split on its validation rows; kept shards are then refit on
+    train + val like `global_model`, and their test R2 is only reported.
+    Returns {"shard_by": column, "shards": {shard feature: {"model", "columns", "rows", "val_r2",
+    "global_val_r2", "test_r2", "global_test_r2"}}}.
+    """
+    shard_column = SHARD_COLUMNS[shard_by]
+    prefix = normalize_column_name(shard_column) + "_"
+    shard_indices = [j for j, name in enumerate(feature_names) if name.startswith(prefix)]
+    y_train, y_val, y_test = np.asarray(y_train), np.asarray(y_val), np.asarray(y_test)
+
+    candidates = []
+    for j in shard_indices:
+        rows = [np.flatnonzero(column_values(X, j) == 1) for X in (X_train, X_val, X_test)]
+        if len(rows[0]) < min_rows or len(rows[1]) < 2 or len(rows[2]) < 2:
+            continue
+        X_shard = select(X_train, rows[0])
+        spread = np.asarray(X_shard.max(axis=0).todense() - X_shard.min(axis=0).todense()).ravel() if sp.issparse(X_shard) \
+            else np.ptp(np.asarray(X_shard), axis=0)
+        candidates.append((feature_names[j], rows, np.flatnonzero(spread > 0)))
+    if not candidates:
+        logging.warning(f"No {shard_by} shard has {min_rows} training rows; only the global model is used.")
+        return None
+
+    # Keep or drop on the validation split, against a global model that has not seen it
+    logging.info("Fitting the global model on the training split for the shard comparison...")
+    reference = clone(model)
+    reference.fit(densify(X_train, reference), y_train)
+    validated = fit_shards_parallel(model, [
+        (select(X_train, train_rows, columns), y_train[train_rows], select(X_val, val_rows, columns), y_val[val_rows])
+        for _, (train_rows, val_rows, _), columns in candidates
+    ], n_jobs, "Validating")
+
+    kept = []
+    for (key, (train_rows, val_rows, test_rows), columns), (_, val_r2) in zip(candidates, validated):
+        global_val_r2 = float(r2_score(y_val[val_rows], reference.predict(densify(select(X_val, val_rows), reference))))
+        keep = val_r2 >= global_val_r2
+        logging.info(
+            f"{key:40} | rows: {len(train_rows):6} | val R2: {val_r2:.4f} vs global {global_val_r2:.4f}"
+            + ("" if keep else " -> global model")
+        )
+        if keep:
+            kept.append((key, (train_rows, val_rows, test_rows), columns, val_r2, global_val_r2))
+    if not kept:
+        return {"shard_by": shard_column, "shards": {}}
+
+    # Final shard models on train + val, reported on the test split
+    fitted = fit_shards_parallel(model, [
+        (stack([select(X_train, train_rows, columns), select(X_val, val_rows, columns)]),
+         np.concatenate([y_train[train_rows], y_val[val_rows]]),
+         select(X_test, test_rows, columns), y_test[test_rows])
+        for _, (train_rows, val_rows, test_rows), columns, _, _ in kept
+    ], n_jobs, "Refitting")
+
+    shards = {}
+    for (key, (train_rows, val_rows, test_rows), columns, val_r2, global_val_r2), (shard_model, test_r2) in zip(kept, fitted):
+        global_test_r2 = float(r2_score(y_test[test_rows], global_model.predict(densify(select(X_test, test_rows), global_model))))
+        logging.info(f"{key:40} | test R2: {test_r2:.4f} vs global {global_test_r2:.4f}")
+        shards[key] = {
+            "model": shard_model, "columns": columns.tolist(), "rows": int(len(train_rows) + len(val_rows)),
+            "val_r2": val_r2, "global_val_r2": global_val_r2, "test_r2": test_r2, "global_test_r2": global_test_r2,
+        }
+    return {"shard_by": shard_column, "shards": shards}
+
+# ========================== Persistence ==========================
+def save_shard_models(shard_models, model_dir):
+    """Save the shard models next to the global model (or remove stale ones when sharding is off)."""
+    path = os.path.join(model_dir, SHARD_MODELS_FILE)
+    if not shard_models or not shard_models["shards"]:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    joblib.dump(shard_models, path)
+    logging.info(f"{len(shard_models['shards'])} shard model(s) by {shard_models['shard_by']} saved to: {path}")
+    return path
+
+
+def load_shard_models(model_dir, mmap_mode=None):
+    path = os.path.join(model_dir, SHARD_MODELS_FILE)
+    return joblib.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None
+
+# ========================== Dispatch ==========================
+def predict_with_shards(global_model, shard_models, X, df):
+    """
+    Predict every row with the sub-model of its route/airline (taken from the raw request
+    frame `df`), falling back to the global model for rows without a shard model.
+    """
+    if not shard_models:
+        return global_model.predict(X)
+    keys = np.array([shard_feature(shard_models["shard_by"], value) for value in df[shard_models["shard_by"]]])
+    y_pred = np.empty(X.shape[0], dtype=np.float64)
+    remaining = np.ones(X.shape[0], dtype=bool)
+    for key in np.unique(keys):
+        shard = shard_models["shards"].get(key)
+        if shard is None:
+            continue
+        rows = np.flatnonzero(keys == key)
+        y_pred[rows] = shard["model"].predict(densify(select(X, rows, shard["columns"]), shard["model"]))
+        remaining[rows] = False
+    if remaining.any():
+        rows = np.flatnonzero(remaining)
+        y_pred[rows] = global_model.predict(select(X, rows))
+    return y_pred
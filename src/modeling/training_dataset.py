@@ -0,0 +1,123 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from src.modeling.feature_pipeline import TARGET_COLUMN
+
+# ========================== Directory Setup ==========================
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+MODELING_DATA_DIR = os.path.join(BASE_DIR, "data", "data_for_modeling")
+
+# Binary training dataset: uncompressed .npy arrays that can be memory-mapped, plus a manifest.
+#   dense: features.npy (float64, rows x columns)
+#   csr:   features_data.npy + features_indices.npy + features_indptr.npy
+#   both:  target.npy (scaled Total_Price) and manifest.json (format, shape, column names)
+MANIFEST_FILE = "manifest.json"
+TARGET_FILE = "target.npy"
+DENSE_FILE = "features.npy"
+CSR_FILES = {"data": "features_data.npy", "indices": "features_indices.npy", "indptr": "features_indptr.npy"}
+
+
+def save_training_dataset(X, y, columns, output_dir=None):
+    """
+    Save the feature matrix (DataFrame, array or CSR matrix), the target and the column
+    names as a binary dataset. The manifest is written last, so a dataset is only
+    visible to readers once all of its arrays are complete.
+    """
+    output_dir = output_dir or MODELING_DATA_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    if sp.issparse(X):
+        X = X.tocsr()
+        for part, file_name in CSR_FILES.items():
+            np.save(os.path.join(output_dir, file_name), getattr(X, part))
+        data_format = "csr"
+    else:
+        np.save(os.path.join(output_dir, DENSE_FILE), np.ascontiguousarray(np.asarray(X, dtype=np.float64)))
+        data_format = "dense"
+    np.save(os.path.join(output_dir, TARGET_FILE), np.asarray(y, dtype=np.float64))
+    write_dataset_manifest(data_format, X.shape, columns, output_dir)
+
+
+def save_training_dataset_chunks(chunks, n_rows, columns, output_dir=None):
+    """
+    Save a training dataset from (X, y) chunks totalling `n_rows` rows without holding it in
+    memory: dense chunks are written straight into the memory-mapped features.npy; CSR chunks
+    are kept in their compressed form and stacked once at the end.
+    """
+    output_dir = output_dir or MODELING_DATA_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    target = np.lib.format.open_memmap(os.path.join(output_dir, TARGET_FILE), mode="w+", dtype=np.float64, shape=(n_rows,))
+    features, sparse_chunks = None, []
+    start = 0
+    for X, y in chunks:
+        end = start + X.shape[0]
+        target[start:end] = y
+        if sp.issparse(X):
+            sparse_chunks.append(X.tocsr())
+        else:
+            if features is None:
+                features = np.lib.format.open_memmap(
+                    os.path.join(output_dir, DENSE_FILE), mode="w+", dtype=np.float64, shape=(n_rows, len(columns))
+                )
+            features[start:end] = np.asarray(X, dtype=np.float64)
+        start = end
+    if start != n_rows:
+        raise ValueError(f"Expected {n_rows} rows, got {start}: the data changed while it was being read.")
+    target.flush()
+
+    if sparse_chunks:
+        X = sp.vstack(sparse_chunks, format="csr")
+        for part, file_name in CSR_FILES.items():
+            np.save(os.path.join(output_dir, file_name), getattr(X, part))
+        data_format = "csr"
+    else:
+        if features is None:
+            features = np.lib.format.open_memmap(os.path.join(output_dir, DENSE_FILE), mode="w+", dtype=np.float64, shape=(0, len(columns)))
+        features.flush()
+        data_format = "dense"
+    write_dataset_manifest(data_format, (n_rows, len(columns)), columns, output_dir)
+
+
+def write_dataset_manifest(data_format, shape, columns, output_dir):
+    """Write the manifest (last, atomically) that makes a dataset visible to readers."""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = {"format": data_format, "shape": list(shape), "columns": list(columns)}
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    logging.info(f"Training dataset ({data_format}, {shape[0]} x {shape[1]}) saved to: {output_dir}")
+
+
+def has_training_dataset(data_dir=None):
+    return os.path.exists(os.path.join(data_dir or MODELING_DATA_DIR, MANIFEST_FILE))
+
+
+def load_training_dataset(data_dir=None, mmap=True):
+    """
+    Load a binary dataset. With `mmap` the arrays are memory-mapped read-only instead of read:
+    loading is near instant and the pages are shared by every process that maps the same files.
+    Returns (X, y, columns): X is a DataFrame over the dense matrix or a CSR matrix, y a Series.
+    """
+    data_dir = data_dir or MODELING_DATA_DIR
+    with open(os.path.join(data_dir, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    mmap_mode = "r" if mmap else None
+    columns = manifest["columns"]
+
+    if manifest["format"] == "csr":
+        parts = {part: np.load(os.path.join(data_dir, file_name), mmap_mode=mmap_mode) for part, file_name in CSR_FILES.items()}
+        X = sp.csr_matrix((parts["data"], parts["indices"], parts["indptr"]), shape=tuple(manifest["shape"]), copy=False)
+    else:
+        X = pd.DataFrame(np.load(os.path.join(data_dir, DENSE_FILE), mmap_mode=mmap_mode), columns=columns, copy=False)
+    y = pd.Series(np.load(os.path.join(data_dir, TARGET_FILE), mmap_mode=mmap_mode), name=TARGET_COLUMN, copy=False)
+    return X, y, columns
@@ -0,0 +1,123 @@
+import os
+import urllib
+import logging
+from functools import lru_cache
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+from dotenv import load_dotenv
+
+# ========================== Load Environment Variables ==========================
+load_dotenv()
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+
+# DB_BACKEND selects the storage engine used by every pipeline stage:
+#   - "mssql":  SQL Server through pyodbc (default)
+#   - "duckdb": embedded columnar database file at DB_PATH (requires duckdb-engine)
+#   - "sqlite": embedded database file at DB_PATH
+DB_BACKEND = os.getenv("DB_BACKEND", "mssql").lower()
+EMBEDDED_BACKENDS = ("duckdb", "sqlite")
+SUPPORTED_BACKENDS = ("mssql",) + EMBEDDED_BACKENDS
+
+
+def get_db_path(backend=None):
+    """Return the database file used by an embedded backend."""
+    backend = backend or DB_BACKEND
+    return os.getenv("DB_PATH") or os.path.join(BASE_DIR, "data", f"airfare.{backend}")
+
+
+def build_connection_url(backend=None):
+    """Build the SQLAlchemy connection URL for the configured backend."""
+    backend = backend or DB_BACKEND
+    if backend not in SUPPORTED_BACKENDS:
+        raise ValueError(f"Unsupported DB_BACKEND '{backend}'. Choose one of {SUPPORTED_BACKENDS}.")
+
+    if backend in EMBEDDED_BACKENDS:
+        db_path = get_db_path(backend)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        return f"{backend}:///{db_path}"
+
+    params = urllib.parse.quote_plus(
+        f"DRIVER=ODBC Driver {os.getenv('DB_DRIVER', '17')} for SQL Server;"
+        f"SERVER={os.getenv('DB_SERVER')};"
+        f"DATABASE={os.getenv('DB_NAME')};"
+        f"UID={os.getenv('DB_USER')};"
+        f"PWD={os.getenv('DB_PASSWORD')};"
+        f"TrustServerCertificate=yes;"
+        f"CHARSET=UTF8;"
+    )
+    return f"mssql+pyodbc:///?odbc_connect={params}"
+
+
+@lru_cache(maxsize=None)
+def get_engine(backend=None):
+    """Create (once per process) and return the SQLAlchemy engine for a backend."""
+    backend = backend or DB_BACKEND
+    logging.info(f"Connecting to '{backend}' storage backend")
+    if backend == "mssql":
+        return create_engine(build_connection_url(backend), fast_executemany=True)
+    return create_engine(build_connection_url(backend))
+
+# ========================== Dialect Helpers ==========================
+def is_embedded(engine):
+    """Return True when the engine points to an in-process database file."""
+    return engine.dialect.name in EMBEDDED_BACKENDS
+
+
+def get_schema(engine):
+    """Return the schema the pipeline tables live in (SQL Server only)."""
+    return None if is_embedded(engine) else "dbo"
+
+
+def quote(engine, name):
+    """Quote an identifier (e.g. a column with spaces) for the engine's dialect."""
+    return engine.dialect.identifier_preparer.quote(name)
+
+
+def qualified_table(engine, table_name):
+    """Return the quoted, schema-qualified table name for raw SQL statements."""
+    schema = get_schema(engine)
+    quoted = quote(engine, table_name)
+    return f"{schema}.{quoted}" if schema else quoted
+
+
+def table_exists(table_name, engine=None):
+    """Check whether a table exists in the configured backend."""
+    engine = engine or get_engine()
+    return inspect(engine).has_table(table_name, schema=get_schema(engine))
+
+
+def get_columns(table_name, engine=None):
+    """Return the column names of an existing table."""
+    engine = engine or get_engine()
+    query = f"SELECT * FROM {qualified_table(engine, table_name)} WHERE 1 = 0"
+    return pd.read_sql(text(query), engine).columns.tolist()
+
+# ========================== Read / Write ==========================
+def read_query(query, params=None, engine=None, chunksize=None):
+    """Run a SELECT statement and return a DataFrame (or an iterator of chunks)."""
+    engine = engine or get_engine()
+    return pd.read_sql(text(query), engine, params=params, chunksize=chunksize)
+
+
+def read_table(table_name, engine=None, columns=None, chunksize=None):
+    """Read a full table (optionally a subset of columns) into a DataFrame."""
+    engine = engine or get_engine()
+    logging.info(f"Reading data from table: {table_name}")
+    select_cols = ", ".join(quote(engine, c) for c in columns) if columns else "*"
+    query = f"SELECT {select_cols} FROM {qualified_table(engine, table_name)}"
+    return read_query(query, engine=engine, chunksize=chunksize)
+
+
+def write_table(df, table_name, mode, dtype=None, engine=None):
+    """
+    Write a DataFrame into the configured backend with the given mode
+    ('fail', 'replace', 'append'). NVARCHAR dtypes only apply to SQL Server.
+    """
+    engine = engine or get_engine()
+    dtype = dtype if not is_embedded(engine) else None
+    if mode == 'replace' and is_embedded(engine):
+        # pandas reflects the old table to drop it, which duckdb-engine does not fully support
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {qualified_table(engine, table_name)}"))
+    df.to_sql(name=table_name, con=engine, schema=get_schema(engine), if_exists=mode, index=False, dtype=dtype)
+    logging.info(f"Inserted {len(df)} rows into table '{table_name}' ({engine.dialect.name}, mode={mode}).")
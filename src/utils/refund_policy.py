@@ -0,0 +1,52 @@
+import ast
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+@lru_cache(maxsize=None)
+def parse_refund_policy(value):
+    """
+    Parse one stored 'Refund Policy' string (a Python list literal) into a tuple of
+    normalized policy names ("- " bullet prefixes removed). Invalid values give ().
+    Cached by string value: there are only a few dozen distinct policies.
+    """
+    try:
+        policies = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return ()
+    return tuple(p.replace("- ", "") for p in policies)
+
+
+def factorize_refund_policies(values):
+    """
+    Factorize a column of refund policies and parse each distinct value once.
+    Accepts stored strings or already parsed lists/tuples.
+    Returns (codes, policies) where policies[codes[i]] is the parsed tuple of row i.
+    """
+    keys = pd.Series([tuple(v) if isinstance(v, (list, tuple)) else v for v in values], dtype=object)
+    codes, uniques = pd.factorize(keys, use_na_sentinel=False)
+    policies = [
+        value if isinstance(value, tuple)
+        else parse_refund_policy(value) if isinstance(value, str)
+        else ()
+        for value in uniques
+    ]
+    return codes, policies
+
+
+def parse_refund_policies(values):
+    """Parse a column of refund policy strings into lists, one literal_eval per distinct value."""
+    codes, policies = factorize_refund_policies(values)
+    parsed = [list(p) for p in policies]
+    return pd.Series([parsed[c] for c in codes], index=getattr(values, "index", None), dtype=object)
+
+
+def multi_hot_from_codes(codes, policies, label_binarizer):
+    """
+    Multi-hot encode factorized policies: the binarizer runs once per distinct policy
+    and rows are gathered by factor code. Returns a CSR matrix.
+    """
+    unique_rows = sp.csr_matrix(label_binarizer.transform(policies), dtype=np.uint8)
+    return unique_rows[np.asarray(codes)]